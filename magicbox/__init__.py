@@ -0,0 +1,16 @@
+"""
+Submodules are imported on first attribute access, so `import magicbox` stays cheap.
+"""
+import importlib
+
+__all__ = [
+    'django',
+    'utils',
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
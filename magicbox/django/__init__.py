@@ -0,0 +1,44 @@
+"""
+The public names below are imported from their submodule on first access, importing
+magicbox.django neither loads the Django ORM nor reads Django settings.
+"""
+import importlib
+
+import django
+
+if django.VERSION < (3, 2):
+    # Django 3.2 and later find MagicBoxConfig in apps.py on their own.
+    default_app_config = 'magicbox.django.apps.MagicBoxConfig'
+
+_lazy_attributes = {
+    'resource': 'repository',
+    'DjangoRepository': 'repository',
+    'DjangoIncludeFactory': 'factories',
+    'DjangoValuesFactory': 'factories',
+    'DjangoFingerprintFactory': 'factories',
+    'DjangoAggregatorFactory': 'factories',
+    'DjangoLimiterFactory': 'factories',
+    'DjangoSorterFactory': 'factories',
+    'get_config': 'conf',
+}
+
+_lazy_submodules = [
+    'conf',
+    'factories',
+    'repository',
+    'rollups',
+    'snapshots',
+]
+
+__all__ = list(_lazy_attributes) + _lazy_submodules
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        module = importlib.import_module('.' + _lazy_attributes[name], __name__)
+        return getattr(module, name)
+
+    if name in _lazy_submodules:
+        return importlib.import_module('.' + name, __name__)
+
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
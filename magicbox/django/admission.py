@@ -0,0 +1,302 @@
+"""
+Admission control for the `resource` decorator.
+
+Every request gets a cost estimated from the repository the decorator built for it: the depth
+of its includes, the size of its filter tree, aggregations, and whether it lists a whole table.
+The cost is taken from a per client token bucket, clients that run out are answered with a 429
+and a Retry-After header. Requests whose cost reaches `heavy_cost` also need one of `max_heavy`
+global slots, they wait up to `queue_timeout` seconds for one before being shed the same way.
+
+Admission control is off unless enabled in settings:
+
+    MAGIC_BOX_ADMISSION = {
+        'enabled': True,
+        'rate': 20,             # tokens added per client per second
+        'burst': 100,           # bucket size
+        'heavy_cost': 10,
+        'max_heavy': 4,
+        'queue_timeout': 2.0,
+        'backend': 'magicbox.django.admission.CacheBackend',
+        'client_key': 'myapp.utils.client_key',
+    }
+
+The default LocalMemoryBackend limits each process on its own, CacheBackend shares the buckets
+and heavy slots between processes through a Django cache.
+"""
+import math
+import threading
+import time
+
+from magicbox.django.conf import get_config
+
+DEFAULTS = {
+    'enabled': False,
+    'rate': 20,
+    'burst': 100,
+    'heavy_cost': 10,
+    'max_heavy': 4,
+    'queue_timeout': 2.0,
+    'backend': 'magicbox.django.admission.LocalMemoryBackend',
+    'backend_options': {},
+    'client_key': None,
+}
+
+# Weights of the parts of a request in its cost.
+BASE_COST = 1
+INCLUDE_COST = 2
+FILTER_COST = 1
+AGGREGATE_COST = 2
+UNBOUNDED_COST = 3
+
+
+class Throttled(Exception):
+    """
+    Raised when a request is not admitted, `retry_after` is the number of seconds to wait.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__('Request was throttled, retry after %d seconds.' % retry_after)
+        self.retry_after = retry_after
+
+
+class LocalMemoryBackend:
+    """
+    Keeps the token buckets and the heavy query slots in process memory.
+    """
+    MAX_BUCKETS = 10000
+
+    def __init__(self, max_heavy, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.heavy = threading.BoundedSemaphore(max_heavy)
+
+    def consume(self, key, cost, rate, burst):
+        """
+        Takes cost tokens from the client's bucket.
+
+        :return: float - 0 if the tokens were taken, otherwise the seconds until they will be available.
+        """
+        with self.lock:
+            now = self.clock()
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            if tokens < cost:
+                self.buckets[key] = (tokens, now)
+                return (cost - tokens) / rate
+
+            self.buckets[key] = (tokens - cost, now)
+
+            if len(self.buckets) > self.MAX_BUCKETS:
+                self.prune(now, rate, burst)
+
+            return 0
+
+    def prune(self, now, rate, burst):
+        # Buckets that have refilled completely behave exactly like missing ones.
+        for key, (tokens, updated) in list(self.buckets.items()):
+            if tokens + (now - updated) * rate >= burst:
+                del self.buckets[key]
+
+    def acquire(self, timeout):
+        return self.heavy.acquire(timeout=timeout)
+
+    def release(self, slot=True):
+        self.heavy.release()
+
+
+class CacheBackend:
+    """
+    Keeps the token buckets and the heavy query slots in a Django cache so they are shared between processes.
+
+    Bucket updates are read-modify-write without a lock, concurrent requests of the same client can
+    occasionally both be admitted. Each heavy slot is its own cache key, claimed with the cache's
+    atomic add and expiring after SLOT_TIMEOUT seconds, so a slot held by a dead process is freed
+    on its own while the other slots stay held. Requests running longer than SLOT_TIMEOUT lose
+    their slot.
+    """
+    POLL_INTERVAL = 0.05
+    SLOT_TIMEOUT = 300
+
+    def __init__(self, max_heavy, cache_alias='default', key_prefix='magicbox:admission', clock=time.time):
+        from django.core.cache import caches
+
+        self.cache = caches[cache_alias]
+        self.max_heavy = max_heavy
+        self.key_prefix = key_prefix
+        self.clock = clock
+
+    def consume(self, key, cost, rate, burst):
+        cache_key = '%s:bucket:%s' % (self.key_prefix, key)
+        now = self.clock()
+        tokens, updated = self.cache.get(cache_key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+
+        # The bucket is full again once it expires, so it does not need to be kept longer.
+        timeout = int(math.ceil(burst / float(rate))) + 1
+
+        if tokens < cost:
+            self.cache.set(cache_key, (tokens, now), timeout)
+            return (cost - tokens) / rate
+
+        self.cache.set(cache_key, (tokens - cost, now), timeout)
+        return 0
+
+    def acquire(self, timeout):
+        """
+        Claims one of the heavy slots.
+
+        :return: (cache key, holder) of the claimed slot, or False if none was free within timeout.
+        """
+        import uuid
+
+        holder = uuid.uuid4().hex
+        deadline = self.clock() + timeout
+
+        while True:
+            for index in range(self.max_heavy):
+                cache_key = '%s:heavy:%d' % (self.key_prefix, index)
+                if self.cache.add(cache_key, holder, self.SLOT_TIMEOUT):
+                    return cache_key, holder
+
+            if self.clock() >= deadline:
+                return False
+
+            time.sleep(self.POLL_INTERVAL)
+
+    def release(self, slot):
+        cache_key, holder = slot
+
+        # A slot that expired may have been claimed by another request since.
+        if self.cache.get(cache_key) == holder:
+            self.cache.delete(cache_key)
+
+
+def get_client_key(request):
+    """
+    Identifies the client of a request by its authenticated user, or its remote address.
+    """
+    user = getattr(request, 'user', None)
+
+    if user is not None and getattr(user, 'is_authenticated', False):
+        return 'user:%s' % user.pk
+
+    return 'ip:%s' % request.META.get('REMOTE_ADDR', '')
+
+
+def estimate_cost(repository):
+    """
+    Estimates the relative database cost of a request from its repository. Each level of an
+    include costs a query, each filter a predicate, and a listing without filters reads the
+    whole table.
+
+    :param repository: DjangoRepository
+    :return: int
+    """
+    cost = BASE_COST
+
+    for include in repository.includes or []:
+        cost += INCLUDE_COST * len(include.split(get_config().relation_delimiter))
+
+    cost += FILTER_COST * count_filters(repository.filters)
+
+    if repository.aggregate:
+        cost += AGGREGATE_COST
+
+    if not repository.filters:
+        cost += UNBOUNDED_COST
+
+    return cost
+
+
+def count_filters(filters):
+    if not isinstance(filters, dict):
+        return 0
+
+    return sum(count_filters(value) if isinstance(value, dict) else 1 for value in filters.values())
+
+
+class AdmissionController:
+    """
+    Admits requests against the client's token bucket and the global heavy query slots.
+    """
+
+    def __init__(self, backend, rate, burst, heavy_cost, max_heavy, queue_timeout, client_key=get_client_key):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.heavy_cost = heavy_cost
+        self.max_heavy = max_heavy
+        self.queue_timeout = queue_timeout
+        self.client_key = client_key
+
+    def admit(self, request, repository):
+        """
+        Admits a request or raises Throttled.
+
+        :return: The heavy slot the request holds and has to release, or False.
+        """
+        # A request costing more than the bucket holds could never be admitted.
+        cost = min(estimate_cost(repository), self.burst)
+
+        retry_after = self.backend.consume(self.client_key(request), cost, self.rate, self.burst)
+        if retry_after:
+            raise Throttled(retry_after)
+
+        if cost < self.heavy_cost:
+            return False
+
+        slot = self.backend.acquire(self.queue_timeout)
+        if not slot:
+            raise Throttled(max(self.queue_timeout, 1))
+
+        return slot
+
+    def release(self, heavy):
+        if heavy:
+            self.backend.release(heavy)
+
+
+_controller = None
+_controller_config = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    """
+    Returns the AdmissionController for the current settings, or None if admission control is off.
+    """
+    global _controller, _controller_config
+    from django.utils.module_loading import import_string
+
+    config = get_config()
+
+    with _controller_lock:
+        if config is not _controller_config:
+            options = dict(DEFAULTS, **config.admission)
+            _controller_config = config
+            _controller = None
+
+            if options['enabled']:
+                backend = import_string(options['backend'])(options['max_heavy'], **options['backend_options'])
+                client_key = import_string(options['client_key']) if options['client_key'] else get_client_key
+                _controller = AdmissionController(
+                    backend,
+                    rate=options['rate'],
+                    burst=options['burst'],
+                    heavy_cost=options['heavy_cost'],
+                    max_heavy=options['max_heavy'],
+                    queue_timeout=options['queue_timeout'],
+                    client_key=client_key,
+                )
+
+    return _controller
+
+
+def throttled_response(error):
+    from django.http import HttpResponse
+
+    response = HttpResponse(str(error), status=429, content_type='text/plain')
+    response['Retry-After'] = str(int(math.ceil(error.retry_after)))
+    return response
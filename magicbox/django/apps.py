@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class MagicBoxConfig(AppConfig):
+    name = 'magicbox.django'
+    label = 'magicbox'
+    verbose_name = 'Magic Box'
+
+    def ready(self):
+        from magicbox.django import rollups, snapshots
+        rollups.register_from_settings()
+        snapshots.register_from_settings()
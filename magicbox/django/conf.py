@@ -0,0 +1,78 @@
+"""
+Magic Box settings, resolved once into a frozen Config object.
+
+Settings are read from django.conf.settings on the first call to `get_config()` and cached.
+The cache is dropped when Django sends `setting_changed` for one of them, ex: inside override_settings.
+"""
+from collections import namedtuple
+
+from django.core.signals import setting_changed
+
+# Config attribute -> (Django setting, default)
+SETTINGS = {
+    'relation_delimiter': ('MAGIC_BOX_RELATION_DELIMITER', '.'),
+    'filters_param': ('MAGIC_BOX_FILTERS_PARAM', 'filters'),
+    'include_param': ('MAGIC_BOX_INCLUDE_PARAM', 'include'),
+    'aggregate_param': ('MAGIC_BOX_AGGREGATE_PARAM', 'aggregate'),
+    'sort_param': ('MAGIC_BOX_SORT_PARAM', 'sort'),
+    'group_param': ('MAGIC_BOX_GROUP_PARAM', 'group'),
+    'etag_field': ('MAGIC_BOX_ETAG_FIELD', 'updated_at'),
+    'etag_pk_fallback': ('MAGIC_BOX_ETAG_PK_FALLBACK', False),
+    'sort_index_policy': ('MAGIC_BOX_SORT_INDEX_POLICY', 'ignore'),
+    'rollups': ('MAGIC_BOX_ROLLUPS', {}),
+    'snapshots': ('MAGIC_BOX_SNAPSHOTS', {}),
+    'max_body_size': ('MAGIC_BOX_MAX_BODY_SIZE', 10 * 1024 * 1024),
+    'write_batch_size': ('MAGIC_BOX_WRITE_BATCH_SIZE', 500),
+    'admission': ('MAGIC_BOX_ADMISSION', {}),
+    'default_charset': ('DEFAULT_CHARSET', 'utf-8'),
+}
+
+Config = namedtuple('Config', sorted(SETTINGS))
+
+_config = None
+
+
+def get_config():
+    """
+    Returns the resolved Config, reading Django settings on first use.
+
+    :return: Config
+    """
+    global _config
+
+    if _config is None:
+        from django.conf import settings
+        _config = Config(**{
+            name: getattr(settings, setting, default) for name, (setting, default) in SETTINGS.items()
+        })
+
+    return _config
+
+
+def reset_config(setting=None, **kwargs):
+    """
+    Drops the resolved Config so it is read again on next use. Connected to `setting_changed`.
+
+    :param setting: The name of the changed setting, the Config is only dropped if it uses it.
+    :return:
+    """
+    global _config
+
+    if setting is None or setting in [name for name, default in SETTINGS.values()]:
+        _config = None
+
+
+setting_changed.connect(reset_config, dispatch_uid='magicbox.conf.reset_config')
+
+
+class ConfigAttribute:
+    """
+    A class attribute that reads its value from the Config, ex: `RELATION_DELIMITER = ConfigAttribute('relation_delimiter')`.
+    Works on both the class and its instances.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        return getattr(get_config(), self.name)
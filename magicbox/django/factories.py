@@ -1,17 +1,39 @@
-from django.conf import settings
+from collections import defaultdict
+
 from django.core.exceptions import FieldDoesNotExist
-from django.db.models import Avg, Max, Min, Sum, Count
-from django.db.models import Q
+from magicbox.django.conf import ConfigAttribute, get_config
+
+_instances = {}
+
+
+class SharedFactory:
+    """
+    Factories keep no per request state, only the model they work on. `for_model` returns one
+    shared instance per factory class and model, so requests do not allocate factories.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def for_model(cls, model):
+        try:
+            return _instances[cls, model]
+        except KeyError:
+            instance = _instances[cls, model] = cls.from_model(model)
+            return instance
 
-# Delimiter to split relationship chains
-RELATION_DELIMITER = getattr(settings, 'MAGIC_BOX_RELATION_DELIMITER', '.')
+    @classmethod
+    def from_model(cls, model):
+        return cls(model)
 
 
-class DjangoIncludeFactory:
+class DjangoIncludeFactory(SharedFactory):
     """
     The include factory constructs
     """
-    RELATION_DELIMITER = RELATION_DELIMITER
+    __slots__ = ('model',)
+
+    # Delimiter to split relationship chains, MAGIC_BOX_RELATION_DELIMITER
+    RELATION_DELIMITER = ConfigAttribute('relation_delimiter')
     RELATION_GLUE = '__'
 
     def __init__(self, model):
@@ -82,14 +104,255 @@ class DjangoIncludeFactory:
             include = self.parse_include(include)
 
             # If a relationship chain was valid we add it to the list.
-            if include is not '':
+            if include != '':
                 p = Prefetch(include)
                 prefetch_list.append(p)
 
         return prefetch_list
 
 
-class DjangoAggregatorFactory:
+class DjangoValuesFactory(SharedFactory):
+    """
+    The values factory reads a query set into plain dicts without creating model instances.
+
+    Rows are fetched with `values_list` and every included relation is fetched with a
+    single `values_list` query per relation. Related rows are grouped by the key that
+    points back at their parent in one pass and stitched onto the parent dicts.
+    """
+    __slots__ = ('model',)
+
+    RELATION_GLUE = '__'
+
+    def __init__(self, model):
+        self.model = model
+
+    def build_include_tree(self, includes):
+        """
+        Turns a list of relationship chains into a nested dict of relations. Invalid
+        relationships are dropped the same way `DjangoIncludeFactory.parse_include` drops them.
+
+        Example:
+                given ['articles.comments', 'articles.author', 'person']
+
+                it will return {'articles': {'comments': {}, 'author': {}}, 'person': {}}
+
+        :param includes: list
+        :return: dict
+        """
+        include_factory = DjangoIncludeFactory.for_model(self.model)
+        tree = {}
+
+        for include in includes:
+            include = include_factory.parse_include(include)
+
+            if not include:
+                continue
+
+            current = tree
+            for related in include.split(self.RELATION_GLUE):
+                current = current.setdefault(related, {})
+
+        return tree
+
+    def get_columns(self, model):
+        """
+        Returns the column names fetched for a model, foreign keys are returned by their attname (`blog_id`).
+
+        :param model:
+        :return: list
+        """
+        return [field.attname for field in model._meta.concrete_fields]
+
+    def construct_values(self, query_set, includes=None):
+        """
+        Evaluates the query set and returns a list of dicts, one per row, with the included
+        relations nested under their relation name.
+
+        :param query_set:
+        :param includes: list
+        :return: list
+        """
+        columns = self.get_columns(self.model) + list(query_set.query.annotation_select)
+        rows = [dict(zip(columns, row)) for row in query_set.values_list(*columns)]
+
+        if includes:
+            self.attach_relations(self.model, rows, self.build_include_tree(includes))
+
+        return rows
+
+    def attach_relations(self, model, rows, tree):
+        """
+        Fetches every relation in the tree for the given parent rows and nests the results
+        into them. Each relation costs exactly one query no matter how many parents there are.
+
+        :param model: The model the rows belong to.
+        :param rows: list of dicts
+        :param tree: dict of relations as returned by build_include_tree
+        :return:
+        """
+        if not rows:
+            return
+
+        for name, subtree in tree.items():
+            field = model._meta.get_field(name)
+
+            if field.concrete and (field.many_to_one or field.one_to_one):
+                self._attach_forward(field, rows, subtree)
+            else:
+                self._attach_reverse(model, field, rows, subtree)
+
+    def _attach_forward(self, field, rows, subtree):
+        related_model = field.related_model
+        columns = self.get_columns(related_model)
+        pk_name = related_model._meta.pk.attname
+
+        keys = set(row[field.attname] for row in rows)
+        keys.discard(None)
+
+        children = []
+        if keys:
+            query_set = related_model._default_manager.filter(pk__in=keys).values_list(*columns)
+            children = [dict(zip(columns, row)) for row in query_set]
+
+        self.attach_relations(related_model, children, subtree)
+
+        by_pk = {child[pk_name]: child for child in children}
+        for row in rows:
+            row[field.name] = by_pk.get(row[field.attname])
+
+    def _attach_reverse(self, model, field, rows, subtree):
+        related_model = field.related_model
+        columns = self.get_columns(related_model)
+        pk_name = model._meta.pk.attname
+
+        # The lookup from the related model back to the parent. Reverse relations point back
+        # through the field that created them, many to many fields through their query name.
+        if field.concrete:
+            back = field.related_query_name()
+        else:
+            back = field.field.name
+
+        keys = set(row[pk_name] for row in rows)
+        query_set = related_model._default_manager \
+            .filter(**{back + '__in': keys}) \
+            .values_list(back, *columns)
+
+        children = []
+        grouped = defaultdict(list)
+        for row in query_set:
+            child = dict(zip(columns, row[1:]))
+            grouped[row[0]].append(child)
+            children.append(child)
+
+        self.attach_relations(related_model, children, subtree)
+
+        for row in rows:
+            group = grouped.get(row[pk_name], [])
+            if field.one_to_one:
+                row[field.name] = group[0] if group else None
+            else:
+                row[field.name] = group
+
+
+class DjangoFingerprintFactory(SharedFactory):
+    """
+    The fingerprint factory computes a cheap version of a query's result in the database.
+
+    For the query set itself and for every included relation it aggregates the max of a
+    version field (usually `updated_at`) together with a count. Any insert, update or delete
+    touching the result changes at least one of these values, without fetching any rows.
+    """
+    __slots__ = ('model',)
+
+    RELATION_GLUE = '__'
+
+    def __init__(self, model):
+        self.model = model
+
+    def build_relation_paths(self, includes):
+        """
+        Returns every valid relation path touched by the includes, including the intermediate ones.
+
+        Example:
+                given ['articles.comments', 'person']
+
+                it will return ['articles', 'articles__comments', 'person']
+
+        :param includes: list
+        :return: list
+        """
+        include_factory = DjangoIncludeFactory.for_model(self.model)
+        paths = []
+
+        for include in includes or []:
+            relations = include_factory.parse_include(include).split(self.RELATION_GLUE)
+
+            for index in range(len(relations)):
+                path = self.RELATION_GLUE.join(relations[:index + 1])
+                if path and path not in paths:
+                    paths.append(path)
+
+        return paths
+
+    def get_related_model(self, path):
+        model = self.model
+        for related in path.split(self.RELATION_GLUE):
+            model = model._meta.get_field(related).related_model
+        return model
+
+    def has_field(self, model, field):
+        try:
+            model._meta.get_field(field)
+            return True
+        except FieldDoesNotExist:
+            return False
+
+    def construct_fingerprint(self, query_set, includes, field, pk_fallback=False):
+        """
+        Returns a list of (max, count) tuples, the first for the query set and one per relation path.
+
+        Included relations without the version field can not be fingerprinted, editing one of
+        their rows changes neither their count nor the max of their primary key. None is returned
+        for them, unless pk_fallback is set and the max of their primary key is used anyway.
+
+        :param query_set:
+        :param includes: list
+        :param field: str - The version field, ex: 'updated_at'
+        :param pk_fallback: bool
+        :return: list or None
+        """
+        from django.db.models import Count, Max
+
+        relation_fields = []
+        for path in self.build_relation_paths(includes):
+            related_model = self.get_related_model(path)
+
+            if self.has_field(related_model, field):
+                relation_fields.append((path, field))
+            elif pk_fallback:
+                relation_fields.append((path, related_model._meta.pk.name))
+            else:
+                return None
+
+        # Every relation path is aggregated in its own query, joining sibling relations in
+        # one query would multiply their rows with each other.
+        query_set = query_set.order_by()
+        result = query_set.aggregate(max=Max(field), count=Count('pk'))
+        fingerprint = [(result['max'], result['count'])]
+
+        for path, related_field in relation_fields:
+            result = query_set.aggregate(
+                max=Max(path + self.RELATION_GLUE + related_field),
+                count=Count(path, distinct=True),
+            )
+            fingerprint.append((result['max'], result['count']))
+
+        return fingerprint
+
+
+class DjangoAggregatorFactory(SharedFactory):
+    __slots__ = ('model',)
+
     supported_aggregations = [
         'avg',
         'max',
@@ -102,13 +365,44 @@ class DjangoAggregatorFactory:
         self.model = model
 
     def construct_aggregator(self, aggregation):
-        operation, field = aggregation.popitem()
+        # The last operation wins, read without popping it so the request's aggregation can be applied again.
+        operation, field = list(aggregation.items())[-1]
 
         if self.has_field(field):
             return self.determine_aggregator(operation, field)
 
         return False
 
+    def construct_from_rollup(self, aggregation, group_by, filters=None):
+        """
+        Answers a grouped aggregation from a materialized rollup, see magicbox.django.rollups.
+
+        Params:
+            aggregation (dict) - A single operation to field mapping, ex: {'count': 'id'}
+            group_by (list) - The fields the aggregation is grouped by.
+            filters (dict) - The request's filters, only exact filters on the grouped fields can be answered.
+
+        Returns:
+            list - Rows shaped like `values(*group_by).annotate(aggregation)`, or None if no rollup matches.
+
+        :param aggregation:
+        :param group_by:
+        :param filters:
+        :return:
+        """
+        from magicbox.django import rollups
+
+        if len(aggregation) != 1 or not group_by:
+            return None
+
+        operation, field = next(iter(aggregation.items()))
+        rollup = rollups.find(self.model, group_by, operation, field)
+
+        if rollup is None:
+            return None
+
+        return rollup.read(operation, field, filters, group_by)
+
     def has_field(self, field):
         try:
             self.model._meta.get_field(field)
@@ -117,6 +411,8 @@ class DjangoAggregatorFactory:
             return False
 
     def determine_aggregator(self, operation, field):
+        from django.db.models import Avg, Count, Max, Min, Sum
+
         if operation == 'count':
             return Count(field)
         elif operation == 'sum':
@@ -131,8 +427,14 @@ class DjangoAggregatorFactory:
         return False
 
 
-class DjangoLimiterFactory:
+class DjangoLimiterFactory(SharedFactory):
     """
+    The limiter factory compiles filters into filter and exclude calls, or a Q tree.
+
+    An instance is either bound to a query set, `DjangoLimiterFactory(query_set)`, or shared per
+    model, `DjangoLimiterFactory.for_model(model)`, in which case the query set to limit is passed
+    to `construct_query_set`.
+
     Some TODOs:
     Add filtering across relationship chain: https://docs.djangoproject.com/en/1.9/topics/db/queries/#lookups-that-span-relationships
     All __in filters need to be properly parsed. Currently they will fail to parse correctly.
@@ -152,27 +454,20 @@ class DjangoLimiterFactory:
         '!~': ('__contains', 'exclude'),
     }
 
-    supported_tokens_one_char = [
-        '^',
-        '~',
-        '$',
-        '<',
-        '>',
-        '=',
-        '[',
-    ]
+    # Token -> (method, lookup), built once from supported_tokens.
+    limiter_dispatch = {token: (method, lookup) for token, (lookup, method) in supported_tokens.items()}
 
-    supported_tokens_two_char = [
-        '>=',
-        '<=',
-        '!=',
-        '![',
-        '!~',
-    ]
+    __slots__ = ('query_set', 'model')
 
     def __init__(self, query_set):
         self.query_set = query_set
-        self.q = Q()
+        self.model = getattr(query_set, 'model', None)
+
+    @classmethod
+    def from_model(cls, model):
+        instance = cls(None)
+        instance.model = model
+        return instance
 
     def determine_limiter(self, token_value):
         """
@@ -188,31 +483,28 @@ class DjangoLimiterFactory:
 
                 The first value is
 
+        The longest matching token wins, so ">=5" is "__gte", "5" rather than "__gt", "=5".
+
         :param token_value: str
         :return: str, str, str
         """
-        if token_value[0] in self.supported_tokens_one_char:
-            token, method = self.supported_tokens[token_value[0]]
-            value = token_value[1:]
-            return method, token, value
+        for length in (2, 1):
+            limiter = self.limiter_dispatch.get(token_value[:length])
+            if limiter is not None:
+                return limiter[0], limiter[1], token_value[length:]
 
-        if token_value[:2] in self.supported_tokens_two_char:
-            token, method = self.supported_tokens[token_value[:2]]
-            value = token_value[2:]
-            return method, token, value
-
-    def construct_simple_query_set(self, filters):
+    def construct_simple_query_set(self, filters, query_set=None):
 
         limiters = {
             'filter': {},
             'exclude': {},
         }
 
-        query_set = self.query_set
+        query_set = self.query_set if query_set is None else query_set
 
         for column, limiter in filters.items():
             try:
-                self.query_set.model._meta.get_field(column)
+                self.model._meta.get_field(column)
                 method, token, value = self.determine_limiter(limiter)
                 limiters[method][column + token] = value
             except FieldDoesNotExist:
@@ -226,91 +518,436 @@ class DjangoLimiterFactory:
 
         return query_set
 
-    def construct_complex_query_set(self, filters):
-        query_dict = self.recursive_queries(filters, filters)
+    def construct_complex_query_set(self, filters, query_set=None):
+        query_set = self.query_set if query_set is None else query_set
+        q = self.compile_filters(filters)
 
-        q = self.q
-        q = self.forward_build_qs(query_dict, q)
+        if q is None:
+            return query_set
 
-        return self.query_set.filter(q)
+        return query_set.filter(q)
 
-    def forward_build_qs(self, tree, q, operator=Q.AND):
-        # @TODO figure out how you eneded up actually making it work... Try to improve code readability...
-        popdq = q.add(tree.pop('q'), operator)
+    def compile_filters(self, filters):
+        """
+        Compiles a tree of filters with nested 'and' / 'or' branches into a single Q object.
 
-        if tree:
-            for k, v in tree.items():
-                if k == 'or':
-                    self.forward_build_qs(v, popdq, Q.OR)
-                if k == 'and':
-                    self.forward_build_qs(v, popdq, Q.AND)
+        The predicates of a level are AND'ed together, its exclude predicates negated as a
+        group the same way `exclude(**kwargs)` does. The levels are then read as one expression,
+        each joined to the levels before it by the connector of its branch, in the order the
+        branches were given, with AND binding tighter than OR as it does in SQL:
 
-        return popdq
+            {'title': '=a', 'and': {'title': '=b', 'or': {'author': '=1'}}}
 
-    def recursive_queries(self, dict_queries, current):
-        apply = {}
-        negate = {}
+        compiles to `(title = a AND title = b) OR author = 1`. Chains of the same connector are
+        flattened into one node and duplicate predicates are dropped, so the SQL has no
+        redundant parentheses. The filters are walked once and never modified.
 
-        new_tree = {}
+        :param filters: dict
+        :return: Q or None if no filter was valid.
+        """
+        from django.db.models import Q
 
-        for k, v in dict_queries.items():
-            if isinstance(v, dict):
-                current = current[k]
-                new_tree[k] = self.recursive_queries(v, current)
+        groups = []
+        for connector, term in self._compile_levels(filters, Q.AND):
+            if connector == Q.OR or not groups:
+                groups.append([term])
             else:
-                try:
-                    self.query_set.model._meta.get_field(k)
-                    method, token, value = self.determine_limiter(v)
+                groups[-1].append(term)
 
-                    if method == 'filter':
-                        apply[k + token] = value
-                    if method == 'exclude':
-                        negate[k + token] = value
-                except FieldDoesNotExist:
-                    pass
+        node = self._combine([self._combine(group, Q.AND) for group in groups], Q.OR)
 
-        if apply and negate:
-            new_tree['q'] = Q(**apply) & ~Q(**negate)
-        elif apply:
-            new_tree['q'] = Q(**apply)
-        elif negate:
-            new_tree['q'] = ~Q(**negate)
+        if node is None:
+            return None
 
-        return new_tree
+        if isinstance(node, tuple):
+            return self._build_q([node], Q.AND)
 
-    def construct_query_set(self, filters):
+        return node
+
+    def _compile_levels(self, filters, connector):
+        """
+        Yields a (connector, term) tuple for every level of the filters with a valid predicate,
+        depth first, the term being the level's predicates combined.
+        """
+        from django.db.models import Q
+
+        apply = []
+        negate = []
+        branches = []
+
+        for column, limiter in filters.items():
+            if isinstance(limiter, dict):
+                if column in ('and', 'or'):
+                    branches.append((Q.OR if column == 'or' else Q.AND, limiter))
+                continue
+
+            predicate = self._compile_predicate(column, limiter)
+            if predicate is None:
+                continue
+
+            method, lookup = predicate
+            if method == 'filter':
+                apply.append(lookup)
+            else:
+                negate.append(lookup)
+
+        term = self._combine(apply, Q.AND)
+
+        if negate:
+            term = self._combine([term, self._combine(negate, Q.AND, negated=True)], Q.AND)
+
+        if term is not None:
+            yield connector, term
+
+        for branch_connector, branch in branches:
+            yield from self._compile_levels(branch, branch_connector)
+
+    def _compile_predicate(self, column, limiter):
+        """
+        Returns a (method, (lookup, value)) tuple for a single filter, or None if it is not valid.
+        """
+        try:
+            self.model._meta.get_field(column)
+        except FieldDoesNotExist:
+            return None
+
+        if not isinstance(limiter, str) or not limiter:
+            return None
+
+        limiter = self.determine_limiter(limiter)
+        if limiter is None:
+            return None
+
+        method, token, value = limiter
+        return method, (column + token, value)
+
+    def _combine(self, children, connector, negated=False):
+        """
+        Combines compiled children with a connector. Children using the same connector are
+        spliced in, duplicates and empty children are dropped and a single child is returned as is.
+
+        :param children: list of (lookup, value) tuples, Q objects or None
+        :param connector: Q.AND or Q.OR
+        :param negated: bool
+        :return: tuple, Q or None
+        """
+        flattened = []
+        seen = set()
+
+        for child in children:
+            if child is None:
+                continue
+
+            if not isinstance(child, tuple) and child.connector == connector and not child.negated:
+                grandchildren = child.children
+            else:
+                grandchildren = [child]
+
+            for grandchild in grandchildren:
+                signature = self._signature(grandchild)
+                if signature not in seen:
+                    seen.add(signature)
+                    flattened.append(grandchild)
+
+        if not flattened:
+            return None
+
+        if len(flattened) == 1 and not negated:
+            return flattened[0]
+
+        return self._build_q(flattened, connector, negated)
+
+    def _build_q(self, children, connector, negated=False):
+        from django.db.models import Q
+
+        q = Q()
+        q.children = children
+        q.connector = connector
+        q.negated = negated
+        return q
+
+    def _signature(self, node):
+        if isinstance(node, tuple):
+            return node
+
+        return node.connector, node.negated, tuple(self._signature(child) for child in node.children)
+
+    def construct_query_set(self, filters, query_set=None):
 
         if 'and' not in filters and 'or' not in filters:
-            return self.construct_simple_query_set(filters)
+            return self.construct_simple_query_set(filters, query_set)
 
-        return self.construct_complex_query_set(filters)
+        return self.construct_complex_query_set(filters, query_set)
 
 
-class DjangoSorterFactory:
+class UnindexedSortError(Exception):
+    """
+    Raised when a sort order is not covered by an index and MAGIC_BOX_SORT_INDEX_POLICY is 'reject'.
+    """
+
+
+class UnindexedSortWarning(RuntimeWarning):
+    """
+    Warned when a sort order is not covered by an index and MAGIC_BOX_SORT_INDEX_POLICY is 'warn'.
+    """
+
+
+class DjangoSorterFactory(SharedFactory):
+    """
+    The sorter factory compiles sort orders into a list of order_by arguments.
+
+    Sort orders are an ordered, comma delimited list of fields where a leading '-' sorts
+    descending, ex: '-created,name'. Fields may span forward relations, ex: 'author.last_name',
+    and may place nulls with a ':nulls_first' or ':nulls_last' suffix. A dict of field to
+    direction, ex: {'name': 'desc'}, is still accepted.
+
+    The primary key is appended as a tiebreaker unless the order is already unique, so
+    paginated results are stable. When the leading sort field is not covered by an index
+    MAGIC_BOX_SORT_INDEX_POLICY decides whether to 'ignore', 'warn' or 'reject' the order.
+
+    Like the limiter factory an instance is either bound to a query set or shared per model with
+    `for_model`, in which case the query set is passed to `construct_order_by`.
+    """
+    __slots__ = ('query_set', 'model', 'index_policy')
+
+    # Delimiter to split relationship chains, MAGIC_BOX_RELATION_DELIMITER
+    RELATION_DELIMITER = ConfigAttribute('relation_delimiter')
+    RELATION_GLUE = '__'
+    SORT_DELIMITER = ','
+    NULLS_DELIMITER = ':'
+    DESCENDING_PREFIX = '-'
+
     supported_sorters = {
         'asc': '',
         'desc': '-'
     }
 
-    def __init__(self, query_set):
+    supported_nulls = {
+        'nulls_first': 'nulls_first',
+        'nulls_last': 'nulls_last',
+    }
+
+    def __init__(self, query_set, index_policy=None):
         self.query_set = query_set
+        self.model = getattr(query_set, 'model', None)
+        # None follows MAGIC_BOX_SORT_INDEX_POLICY, read when an order is checked.
+        self.index_policy = index_policy
+
+    @classmethod
+    def from_model(cls, model):
+        instance = cls(None)
+        instance.model = model
+        return instance
+
+    def parse_sort_orders(self, sort_orders):
+        """
+        Normalizes sort orders into an ordered list of (field, direction, nulls) tuples.
+
+        Example:
+                given '-created:nulls_last,name'
+
+                it will return [('created', 'desc', 'nulls_last'), ('name', 'asc', None)]
+
+        :param sort_orders: str, list or dict
+        :return: list
+        """
+        if isinstance(sort_orders, dict):
+            parsed = []
+            for field, direction in sort_orders.items():
+                direction, _, nulls = direction.partition(self.NULLS_DELIMITER)
+                parsed.append((field, direction.lower(), nulls.lower() or None))
+            return parsed
+
+        if isinstance(sort_orders, str):
+            sort_orders = [sort_orders]
+
+        parsed = []
+        for sort_order in sort_orders:
+            for key in sort_order.split(self.SORT_DELIMITER):
+                key = key.strip()
+                if key:
+                    parsed.append(self.parse_sort_key(key))
+
+        return parsed
+
+    def parse_sort_key(self, key):
+        field, _, nulls = key.partition(self.NULLS_DELIMITER)
+        direction = 'asc'
 
-    def construct_order_by(self, sort_orders):
+        if field.startswith(self.DESCENDING_PREFIX):
+            field = field[len(self.DESCENDING_PREFIX):]
+            direction = 'desc'
+
+        return field, direction, nulls.lower() or None
+
+    def construct_order_by(self, sort_orders, query_set=None, columns=None):
+        """
+        Returns the order_by arguments for the sort orders. Unless the sorted fields identify a
+        single row the primary key is appended so the order is stable across pages.
+
+        :param sort_orders: dict
+        :param query_set: The query set being sorted, defaults to the bound one.
+        :param columns: list - Only sort on these columns and leave out the primary key, for
+            grouped query sets where any other column would be added to the GROUP BY.
+        :return: list
+        """
+        query_set = self.query_set if query_set is None else query_set
         order_by = []
+        sorted_fields = []
+
+        for field, direction, nulls in self.parse_sort_orders(sort_orders):
+            resolved = self.resolve_field(field, query_set)
+            ops = self.determine_operation(direction)
+
+            if resolved is None or ops is None:
+                continue
+
+            path, model_field = resolved
+
+            if columns is not None and path not in columns:
+                continue
 
-        for field, direction in sort_orders.items():
-            if self.has_field(field):
-                ops = self.determine_operation(direction)
-                order_by.append(ops + field)
+            # A field sorted twice would only ever be sorted by its first occurrence.
+            if path in [sorted_path for sorted_path, _ in sorted_fields]:
+                continue
+
+            order_by.append(self.build_order(path, ops, self.supported_nulls.get(nulls)))
+            sorted_fields.append((path, model_field))
+
+        if not sorted_fields:
+            return order_by
+
+        self.check_index(sorted_fields[0])
+
+        if columns is None and not self.is_unique(sorted_fields):
+            order_by.append('pk')
 
         return order_by
 
     def determine_operation(self, direction):
         return self.supported_sorters.get(direction.lower())
 
+    def build_order(self, path, ops, nulls=None):
+        """
+        Returns an order_by argument, a plain string unless nulls placement was requested.
+
+        :param path: str
+        :param ops: str - '' or '-'
+        :param nulls: str - None, 'nulls_first' or 'nulls_last'
+        :return: str or OrderBy
+        """
+        if nulls is None:
+            return ops + path
+
+        from django.db.models import F
+
+        expression = F(path)
+        if ops == '-':
+            return expression.desc(**{nulls: True})
+        return expression.asc(**{nulls: True})
+
+    def resolve_field(self, field, query_set=None):
+        """
+        Resolves a delimited field into its django lookup path and model field. Only forward
+        relations are followed, sorting across a to-many relation would duplicate rows.
+        Annotations of the query set are resolved with a model field of None.
+
+        :param field: str, ex: 'author.last_name'
+        :param query_set: The query set being sorted, defaults to the bound one.
+        :return: (str, Field) or None if the field is invalid.
+        """
+        query_set = self.query_set if query_set is None else query_set
+        relations = field.split(self.RELATION_DELIMITER)
+        model = self.model
+
+        if len(relations) == 1 and query_set is not None and relations[0] in query_set.query.annotation_select:
+            return relations[0], None
+
+        for index, name in enumerate(relations):
+            if name == 'pk':
+                name = model._meta.pk.name
+
+            try:
+                model_field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                return None
+
+            if not model_field.concrete or model_field.many_to_many:
+                return None
+
+            relations[index] = name
+
+            if index + 1 < len(relations):
+                if not model_field.is_relation:
+                    return None
+                model = model_field.related_model
+
+        return self.RELATION_GLUE.join(relations), model_field
+
     def has_field(self, field):
-        try:
-            self.query_set.model._meta.get_field(field)
+        return self.resolve_field(field) is not None
+
+    def is_unique(self, sorted_fields):
+        """
+        Checks if the local fields being sorted on already identify a single row.
+
+        :param sorted_fields: list of (path, model field) tuples
+        :return: bool
+        """
+        local_fields = set()
+
+        for path, model_field in sorted_fields:
+            if model_field is None or self.RELATION_GLUE in path:
+                continue
+            if model_field.primary_key or model_field.unique:
+                return True
+            local_fields.add(path)
+
+        meta = self.model._meta
+        for unique_together in meta.unique_together:
+            if set(unique_together) <= local_fields:
+                return True
+
+        return False
+
+    def is_indexed(self, path, model_field):
+        """
+        Checks if an index on the model starts with the field, so the database can read rows in order.
+
+        :param path: str
+        :param model_field: Field or None for annotations
+        :return: bool
+        """
+        if model_field is None or self.RELATION_GLUE in path:
+            return False
+
+        if model_field.primary_key or model_field.unique or model_field.db_index:
             return True
-        except FieldDoesNotExist:
-            return field in list(self.query_set.query.annotation_select)
+
+        meta = self.model._meta
+        leading_fields = [fields[0] for fields in getattr(meta, 'index_together', ()) if fields]
+        leading_fields += [fields[0] for fields in meta.unique_together if fields]
+        leading_fields += [index.fields[0].lstrip('-') for index in getattr(meta, 'indexes', []) if index.fields]
+
+        return path in leading_fields
+
+    def check_index(self, sorted_field):
+        """
+        Applies MAGIC_BOX_SORT_INDEX_POLICY to the leading sort field.
+
+        :param sorted_field: (path, model field) tuple
+        :return:
+        """
+        path, model_field = sorted_field
+        index_policy = self.index_policy or get_config().sort_index_policy
+
+        if index_policy == 'ignore' or self.is_indexed(path, model_field):
+            return
+
+        message = 'Sorting %s by %r is not covered by an index.' % (self.model.__name__, path)
+
+        if index_policy == 'reject':
+            raise UnindexedSortError(message)
+
+        import warnings
+        warnings.warn(message, UnindexedSortWarning)
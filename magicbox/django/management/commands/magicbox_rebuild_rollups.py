@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from magicbox.django import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds materialized aggregate rollups from their base tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Names of the rollups to rebuild, all rollups when omitted.')
+
+    def handle(self, *args, **options):
+        registered = rollups.get_rollups()
+        names = options['names']
+
+        unknown = set(names) - set(rollup.name for rollup in registered)
+        if unknown:
+            raise CommandError('Unknown rollups: %s' % ', '.join(sorted(unknown)))
+
+        for rollup in registered:
+            if names and rollup.name not in names:
+                continue
+
+            groups = rollup.rebuild()
+            self.stdout.write('Rebuilt %s (%d groups)' % (rollup.name, groups))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from magicbox.django import snapshots
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds denormalized include snapshots from their relations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Names of the snapshots to rebuild, all snapshots when omitted.')
+
+    def handle(self, *args, **options):
+        registered = snapshots.get_snapshots()
+        names = options['names']
+
+        unknown = set(names) - set(snapshot.name for snapshot in registered)
+        if unknown:
+            raise CommandError('Unknown snapshots: %s' % ', '.join(sorted(unknown)))
+
+        for snapshot in registered:
+            if names and snapshot.name not in names:
+                continue
+
+            rows = snapshot.rebuild()
+            self.stdout.write('Rebuilt %s (%d rows)' % (snapshot.name, rows))
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AggregateRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rollup', models.CharField(max_length=255)),
+                ('key', models.CharField(max_length=32)),
+                ('alias', models.CharField(max_length=255)),
+                ('dimensions', models.TextField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('number', models.FloatField(null=True)),
+                ('value', models.TextField(null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='aggregaterollup',
+            unique_together=set([('rollup', 'key', 'alias')]),
+        ),
+    ]
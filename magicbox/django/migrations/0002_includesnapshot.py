@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magicbox', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncludeSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('snapshot', models.CharField(max_length=255)),
+                ('key', models.CharField(max_length=255)),
+                ('data', models.TextField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='includesnapshot',
+            unique_together=set([('snapshot', 'key')]),
+        ),
+    ]
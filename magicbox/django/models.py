@@ -0,0 +1,35 @@
+from django.db import models
+
+
+class AggregateRollup(models.Model):
+    """
+    One aggregation of one group of a materialized aggregate rollup, see magicbox.django.rollups.
+
+    The key is a hash of the group's dimension values so a group can be looked up, the alias names
+    the aggregation. Counts and sums are kept in count and number so they can be updated in place,
+    min and max JSON encoded in value. The dimension values are stored JSON encoded.
+    """
+    rollup = models.CharField(max_length=255)
+    key = models.CharField(max_length=32)
+    alias = models.CharField(max_length=255)
+    dimensions = models.TextField()
+    count = models.BigIntegerField(default=0)
+    number = models.FloatField(null=True)
+    value = models.TextField(null=True)
+
+    class Meta:
+        unique_together = ('rollup', 'key', 'alias')
+
+
+class IncludeSnapshot(models.Model):
+    """
+    The serialized includes of one row, see magicbox.django.snapshots.
+
+    The key is the row's primary key as a string, the data its included relations JSON encoded.
+    """
+    snapshot = models.CharField(max_length=255)
+    key = models.CharField(max_length=255)
+    data = models.TextField()
+
+    class Meta:
+        unique_together = ('snapshot', 'key')
@@ -0,0 +1,329 @@
+"""
+Request body parsers, dispatched on the request's Content-Type.
+
+Parsers are registered per media type with `register_parser` and called with a stream of the
+request body and its charset. A parser returns either the parsed data or, for JSON arrays and
+NDJSON, an iterator that parses one item at a time while reading the body in chunks.
+
+`parse_body` reads such iterators into a list unless it is called with stream=True, which views
+opt into with `resource(model, stream_body=True)`. The iterator can then be fed straight into
+`DjangoRepository.create_many`, which writes it in batches, so memory use is bounded by the
+batch size rather than the body size.
+
+The total body size is capped by MAGIC_BOX_MAX_BODY_SIZE.
+"""
+import codecs
+import json
+from collections.abc import Iterator
+
+CHUNK_SIZE = 64 * 1024
+
+_parsers = {}
+
+
+class ParseError(Exception):
+    """
+    Raised when a request body can not be parsed, `status_code` is the response status to answer with.
+    """
+    status_code = 400
+
+
+class UnsupportedMediaType(ParseError):
+    status_code = 415
+
+
+class RequestEntityTooLarge(ParseError):
+    status_code = 413
+
+
+class LimitedStream:
+    """
+    Wraps a request so that reading more than max_size bytes raises RequestEntityTooLarge.
+    """
+
+    def __init__(self, stream, max_size=None, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.read_size = 0
+
+    def read(self, size=None):
+        data = self.stream.read(size or self.chunk_size)
+        self.read_size += len(data)
+
+        if self.max_size is not None and self.read_size > self.max_size:
+            raise RequestEntityTooLarge('Request body exceeds %d bytes.' % self.max_size)
+
+        return data
+
+    def read_all(self):
+        chunks = []
+        chunk = self.read()
+        while chunk:
+            chunks.append(chunk)
+            chunk = self.read()
+        return b''.join(chunks)
+
+
+def register_parser(*media_types):
+    """
+    Registers the decorated function as the parser for the media types.
+
+    The parser is called as parser(stream, charset) where stream is a LimitedStream.
+
+    :param media_types: str, ex: 'application/json'
+    :return:
+    """
+
+    def decorator(parser):
+        for media_type in media_types:
+            _parsers[media_type.lower()] = parser
+        return parser
+
+    return decorator
+
+
+def get_parser(media_type):
+    return _parsers.get(media_type.lower())
+
+
+def parse_content_type(content_type):
+    """
+    Splits a Content-Type header into its media type and parameters.
+
+    Example:
+            given 'application/json; charset=latin-1'
+
+            it will return 'application/json', {'charset': 'latin-1'}
+
+    :param content_type: str
+    :return: str, dict
+    """
+    media_type, _, params = content_type.partition(';')
+    parsed_params = {}
+
+    for param in params.split(';'):
+        key, _, value = param.partition('=')
+        if key.strip():
+            parsed_params[key.strip().lower()] = value.strip().strip('"')
+
+    return media_type.strip().lower(), parsed_params
+
+
+def parse_body(request, max_size=None, default_charset='utf-8', stream=False):
+    """
+    Parses the request body with the parser registered for its Content-Type. Requests without
+    a Content-Type are parsed as JSON.
+
+    :param request: A Django HttpRequest
+    :param max_size: int - The max body size in bytes, None for no limit.
+    :param default_charset: str - Used when the Content-Type has no charset.
+    :param stream: bool - Return JSON arrays and NDJSON as iterators instead of lists.
+    :return: The parsed data, an iterator for streamed bodies, or None if there is no body.
+    """
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        raise ParseError('Invalid Content-Length.')
+
+    if not content_length:
+        return None
+
+    if max_size is not None and content_length > max_size:
+        raise RequestEntityTooLarge('Request body exceeds %d bytes.' % max_size)
+
+    media_type, params = parse_content_type(request.META.get('CONTENT_TYPE') or 'application/json')
+    parser = get_parser(media_type)
+
+    if parser is None:
+        raise UnsupportedMediaType('Unsupported media type %r.' % media_type)
+
+    data = parser(LimitedStream(request, max_size), params.get('charset') or default_charset)
+
+    if not stream and isinstance(data, Iterator):
+        return list(data)
+
+    return data
+
+
+@register_parser('application/json', 'text/json')
+def parse_json(stream, charset):
+    """
+    Parses a JSON body. A top level array is returned as an iterator over its items.
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(charset)()
+    except LookupError:
+        raise UnsupportedMediaType('Unsupported charset %r.' % charset)
+
+    buffer = ''
+
+    while not buffer.strip():
+        chunk = stream.read()
+        if not chunk:
+            return None
+        try:
+            buffer += decoder.decode(chunk)
+        except UnicodeDecodeError as e:
+            raise ParseError('Invalid encoding: %s' % e)
+
+    buffer = buffer.lstrip()
+
+    if buffer[0] == '[':
+        return iter_json_array(stream, decoder, buffer)
+
+    try:
+        return json.loads(buffer + decoder.decode(stream.read_all(), final=True))
+    except ValueError as e:
+        raise ParseError('Invalid JSON: %s' % e)
+
+
+def iter_json_array(stream, decoder, buffer):
+    """
+    Yields the items of a JSON array one at a time, reading the stream in chunks as needed.
+    Only the unparsed tail of the body and the current item are kept in memory.
+
+    :param stream: LimitedStream positioned after buffer
+    :param decoder: The incremental decoder used for buffer
+    :param buffer: str - The decoded start of the body, starting with '['
+    :return: generator
+    """
+    json_decoder = json.JSONDecoder()
+    position = 1
+    expect_item = True
+    exhausted = False
+
+    while True:
+        # Skip whitespace, reading more when the buffer runs out.
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\n\r':
+                position += 1
+            if position < len(buffer) or exhausted:
+                break
+            buffer, position, exhausted = _read_more(stream, decoder, buffer, position)
+
+        if position >= len(buffer):
+            raise ParseError('Invalid JSON: unexpected end of array.')
+
+        if buffer[position] == ']':
+            return
+
+        if not expect_item:
+            if buffer[position] != ',':
+                raise ParseError('Invalid JSON: expected "," at position %d.' % position)
+            position += 1
+            expect_item = True
+            continue
+
+        # An item is only complete once something follows it, otherwise a number like 12
+        # could be the start of 123 in the next chunk.
+        try:
+            item, end = json_decoder.raw_decode(buffer, position)
+            complete = end < len(buffer)
+        except ValueError as e:
+            if exhausted:
+                raise ParseError('Invalid JSON: %s' % e)
+            complete = False
+
+        # Wait until the pending item has doubled before decoding it again, so an item spanning
+        # many chunks is decoded a logarithmic number of times instead of once per chunk.
+        if not complete and not exhausted:
+            buffer, position, exhausted = _read_more(stream, decoder, buffer, position, len(buffer) - position)
+            continue
+
+        yield item
+        position = end
+        expect_item = False
+
+
+def _read_more(stream, decoder, buffer, position, min_size=0):
+    """
+    Drops the consumed part of the buffer and appends the next chunks of the stream, at least
+    min_size characters unless the stream ends first. The chunks are joined once.
+
+    :return: buffer, position, exhausted
+    """
+    chunks = [buffer[position:]]
+    read_size = 0
+    exhausted = False
+
+    while not exhausted:
+        chunk = stream.read()
+        exhausted = not chunk
+
+        try:
+            chunks.append(decoder.decode(chunk, final=exhausted))
+        except UnicodeDecodeError as e:
+            raise ParseError('Invalid encoding: %s' % e)
+
+        read_size += len(chunks[-1])
+        if read_size >= min_size:
+            break
+
+    return ''.join(chunks), 0, exhausted
+
+
+@register_parser('application/x-ndjson', 'application/ndjson', 'application/jsonlines')
+def parse_ndjson(stream, charset):
+    """
+    Parses newline delimited JSON into an iterator of items, one per non empty line.
+    """
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        raise UnsupportedMediaType('Unsupported charset %r.' % charset)
+
+    def iter_lines():
+        # The chunks of a line spanning many chunks are joined once, when its end is read.
+        pending = []
+        chunk = stream.read()
+
+        while chunk:
+            lines = chunk.split(b'\n')
+            pending.append(lines.pop(0))
+            if lines:
+                yield b''.join(pending)
+                pending = [lines.pop()]
+                for line in lines:
+                    yield line
+            chunk = stream.read()
+
+        yield b''.join(pending)
+
+    def iter_items():
+        for number, line in enumerate(iter_lines(), 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line.decode(charset))
+            except ValueError as e:
+                raise ParseError('Invalid JSON on line %d: %s' % (number, e))
+
+    return iter_items()
+
+
+@register_parser('application/x-www-form-urlencoded')
+def parse_form(stream, charset):
+    """
+    Parses a form body the same way query strings are parsed, `name[key]=value` becomes nested dicts.
+    """
+    from django.http import QueryDict
+    from magicbox.utils import parse_qsl_with_brackets
+
+    return parse_qsl_with_brackets(QueryDict(stream.read_all(), encoding=charset).lists())
+
+
+@register_parser('application/msgpack', 'application/x-msgpack')
+def parse_msgpack(stream, charset):
+    """
+    Parses a msgpack body. Requires the optional msgpack package.
+    """
+    try:
+        import msgpack
+    except ImportError:
+        raise UnsupportedMediaType('msgpack is not installed.')
+
+    try:
+        return msgpack.unpackb(stream.read_all(), raw=False)
+    except Exception as e:
+        raise ParseError('Invalid msgpack: %s' % e)
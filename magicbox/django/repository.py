@@ -1,70 +1,297 @@
-import json
+import datetime
+import hashlib
+from collections import namedtuple
 from functools import wraps
 
-from django.conf import settings
 from django.core.exceptions import FieldDoesNotExist
-from magicbox.magicbox.django.factories import DjangoIncludeFactory, DjangoSorterFactory, DjangoAggregatorFactory, \
-    DjangoLimiterFactory
-from magicbox.magicbox.utils import parse_qsl_with_brackets
+from magicbox.django import admission, parsers, rollups, snapshots
+from magicbox.django.conf import get_config
+from magicbox.django.factories import DjangoIncludeFactory, DjangoSorterFactory, DjangoAggregatorFactory, \
+    DjangoLimiterFactory, DjangoValuesFactory, DjangoFingerprintFactory, UnindexedSortError
+from magicbox.utils import parse_qsl_with_brackets, json_dumps
 
 
-def resource(model):
+def build_etag(request, fingerprint):
+    """
+    Builds a weak ETag from the request path and the query's fingerprint. The path is part of
+    the tag because different filters, includes or sorts over the same rows give different payloads.
+
+    :param request:
+    :param fingerprint: list - As returned by DjangoRepository.fingerprint
+    :return: str
+    """
+    digest = hashlib.md5((request.get_full_path() + repr(fingerprint)).encode('utf-8')).hexdigest()
+    return 'W/"%s"' % digest
+
+
+def etag_matches(etag, if_none_match):
+    """
+    Weakly compares an ETag against the value of an If-None-Match header.
+
+    :param etag: str
+    :param if_none_match: str
+    :return: bool
+    """
+    if if_none_match.strip() == '*':
+        return True
+
+    opaque_tag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque_tag:
+            return True
+
+    return False
+
+
+def get_last_modified(fingerprint):
+    """
+    Returns the newest datetime in the fingerprint as an HTTP date, or None if there is none.
+
+    :param fingerprint: list
+    :return: str
+    """
+    import calendar
+    from django.utils.http import http_date
+
+    modified = [value for value, count in fingerprint if isinstance(value, datetime.datetime)]
+
+    if not modified:
+        return None
+
+    return http_date(calendar.timegm(max(modified).utctimetuple()))
+
+
+def parse_error_response(error):
+    from django.http import HttpResponse
+
+    return HttpResponse(str(error), status=error.status_code, content_type='text/plain')
+
+
+def sort_error_response(error):
+    from django.http import HttpResponseBadRequest
+
+    return HttpResponseBadRequest(str(error), content_type='text/plain')
+
+
+def resource(model, etag_field=None, stream_body=False, conditional=False):
     """
     The resource decorator builds a repository for the model based on inbound request data.
 
+    POST, PUT and PATCH bodies are parsed by the parser registered for their Content-Type, see
+    magicbox.django.parsers. Bodies that can not be parsed are answered with a 400, 413 or 415.
+    JSON arrays and NDJSON are read into a list, views writing them with `create_many` can pass
+    stream_body=True to get them as an iterator that is parsed while the rows are written.
+    Sort orders rejected by MAGIC_BOX_SORT_INDEX_POLICY = 'reject' are answered with a 400.
+
+    When MAGIC_BOX_ADMISSION is enabled requests are admitted by cost per client first, see
+    magicbox.django.admission. Requests that are not admitted are answered with a 429.
+
+    With conditional=True, GET and HEAD requests on models that have the version field
+    (MAGIC_BOX_ETAG_FIELD, default `updated_at`) are made conditional. A fingerprint of the query
+    is computed in the database, one aggregate query for the model and one per included relation,
+    and an If-None-Match header matching it is answered with a 304 without calling the view.
+    Otherwise ETag and Last-Modified are attached to the view's response. The ETag only covers
+    the request path, query string and the fingerprint, so only views whose response depends on
+    nothing else, ex: not on request.user or other tables, should opt in.
+
+    Requests including a relation without the version field are not made conditional, edits of
+    its rows could not be detected. MAGIC_BOX_ETAG_PK_FALLBACK = True makes them conditional on
+    the relation's count and max primary key, which only detects inserts and deletes.
+
     :param model: A Django model
+    :param etag_field: The version field to fingerprint, overrides MAGIC_BOX_ETAG_FIELD.
+    :param stream_body: Pass JSON arrays and NDJSON bodies to the view as iterators.
+    :param conditional: Answer GET and HEAD requests conditionally, see above.
     :return:
     """
 
     def decorator(view_func):
+        def call_view(request, *args, **kwargs):
+            # Streamed bodies are parsed while the view writes them, so parse errors can surface in the view.
+            try:
+                return view_func(request, *args, **kwargs)
+            except parsers.ParseError as e:
+                return parse_error_response(e)
+            except UnindexedSortError as e:
+                return sort_error_response(e)
+
+        def respond(request, repository, *args, **kwargs):
+            field = etag_field or get_config().etag_field
+            if not conditional or request.method not in ('GET', 'HEAD') or not repository._has_field(field):
+                return call_view(request, repository=repository, *args, **kwargs)
+
+            try:
+                fingerprint = repository.fingerprint(field)
+            except UnindexedSortError as e:
+                return sort_error_response(e)
+
+            if fingerprint is None:
+                return call_view(request, repository=repository, *args, **kwargs)
+
+            etag = build_etag(request, fingerprint)
+            last_modified = get_last_modified(fingerprint)
+
+            if etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH', '')):
+                from django.http import HttpResponseNotModified
+
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                if last_modified:
+                    response['Last-Modified'] = last_modified
+                return response
+
+            response = call_view(request, repository=repository, *args, **kwargs)
+
+            if response.status_code == 200:
+                if not response.has_header('ETag'):
+                    response['ETag'] = etag
+                if last_modified and not response.has_header('Last-Modified'):
+                    response['Last-Modified'] = last_modified
+
+            return response
+
         @wraps(view_func)
         def _wrapped_view(request, *args, **kwargs):
+            config = get_config()
+
             # Parse query params that include brackets
             query_params = parse_qsl_with_brackets(request.GET.lists())
 
             # If Django Rest Framework is being used we will use the already parsed data attribute.
             # but if not we will try to parse the data our selves from the body.
             body = getattr(request, 'data', None)
-            if body is None and request.body and (request.method == 'POST' or request.method == 'PUT'):
-                # @TODO we shouldn't just blindly think it's json data. We should be checking the Content-Type header.
-                body = json.loads(request.body.decode(getattr(settings, 'DEFAULT_CHARSET', 'utf-8')))
+            if body is None and request.method in ('POST', 'PUT', 'PATCH'):
+                try:
+                    body = parsers.parse_body(request, config.max_body_size, config.default_charset, stream_body)
+                except parsers.ParseError as e:
+                    return parse_error_response(e)
 
             # Setup the DjangoRepository instance to pass into the view function.
-            filters = query_params.get(getattr(settings, 'MAGIC_BOX_FILTERS_PARAM', 'filters'))
-            include = query_params.get(getattr(settings, 'MAGIC_BOX_INCLUDE_PARAM', 'include'))
-            aggregate = query_params.get(getattr(settings, 'MAGIC_BOX_AGGREGATE_PARAM', 'aggregate'))
-            sort = query_params.get(getattr(settings, 'MAGIC_BOX_SORT_PARAM', 'sort'))
+            repository = DjangoRepository(model, RequestSpec.from_params(query_params, body, config))
 
-            repository = DjangoRepository(model) \
-                .set_input(body) \
-                .set_filters(filters) \
-                .set_includes(include) \
-                .set_aggregate(aggregate) \
-                .set_sort_order(sort)
+            controller = admission.get_controller()
+            if controller is None:
+                return respond(request, repository, *args, **kwargs)
 
-            return view_func(request, repository=repository, *args, **kwargs)
+            try:
+                heavy = controller.admit(request, repository)
+            except admission.Throttled as e:
+                return admission.throttled_response(e)
+
+            try:
+                return respond(request, repository, *args, **kwargs)
+            finally:
+                controller.release(heavy)
 
         return _wrapped_view
 
     return decorator
 
 
+def parse_includes(includes):
+    if isinstance(includes, str):
+        return [includes]
+    return includes
+
+
+def parse_group_by(group_by):
+    if isinstance(group_by, str):
+        group_by = group_by.split(',')
+    return tuple(field.strip() for field in group_by or () if field.strip())
+
+
+class RequestSpec(namedtuple('RequestSpec', ['filters', 'includes', 'aggregate', 'sort_order', 'group_by', 'input'])):
+    """
+    What a request asks of a repository. The resource decorator builds one per request from the
+    query params and body, the repository only reads it. Changing a spec returns a new one.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_params(cls, query_params, body=None, config=None):
+        """
+        Builds a spec from parsed query params, see parse_qsl_with_brackets.
+
+        :param query_params: dict
+        :param body: The parsed request body.
+        :param config: Config, defaults to get_config()
+        :return: RequestSpec
+        """
+        config = config or get_config()
+
+        return cls(
+            filters=query_params.get(config.filters_param),
+            includes=parse_includes(query_params.get(config.include_param)),
+            aggregate=query_params.get(config.aggregate_param),
+            sort_order=query_params.get(config.sort_param),
+            group_by=parse_group_by(query_params.get(config.group_param)),
+            input=body,
+        )
+
+
+# Shared by every repository built without a spec, see spec_property for how its empty values are not modified in place.
+EMPTY_SPEC = RequestSpec(filters={}, includes=[], aggregate={}, sort_order={}, group_by=(), input={})
+
+
+def spec_property(name, empty=None):
+    """
+    A repository attribute read from, and assigned into, its RequestSpec. A repository reading
+    the shared empty value of EMPTY_SPEC gets a fresh one made by `empty` instead, so
+    `DjangoRepository(Article).input['title'] = 'x'` only changes that repository.
+
+    :param name: str - The RequestSpec field.
+    :param empty: callable or None if the field's value is not modified in place.
+    """
+
+    def getter(self):
+        value = getattr(self.spec, name)
+
+        if empty is not None and value is getattr(EMPTY_SPEC, name):
+            value = empty()
+            self.spec = self.spec._replace(**{name: value})
+
+        return value
+
+    def setter(self, value):
+        self.spec = self.spec._replace(**{name: value})
+
+    return property(getter, setter)
+
+
 class DjangoRepository:
     """
     Some TODOs:
     Depth Restriction for limiter statements and includes...
-    Convert Setters/Getters to whatever is the "pythonic way"
+
+    The request is held in an immutable RequestSpec, the setters replace it and are kept so
+    repositories can still be built by chaining them.
     """
 
-    def __init__(self, model):
+    def __init__(self, model, spec=None):
         self.model = model
-        self.filters = {}
-        self.includes = []
+        self.spec = spec or EMPTY_SPEC
         self.query_set = None
-        self.input = {}
-        self.fillable = []
-        self.aggregate = {}
-        self.sort_order = {}
+        self.fillable = ()
+
+    filters = spec_property('filters', dict)
+    includes = spec_property('includes', list)
+    aggregate = spec_property('aggregate', dict)
+    sort_order = spec_property('sort_order', dict)
+    group_by = spec_property('group_by')
+    input = spec_property('input', dict)
+
+    def set_group_by(self, group_by):
+        """
+        Set the fields to group aggregations by, a list or a comma delimited string. They are kept as a tuple.
+
+        :param group_by:
+        :return:
+        """
+        self.group_by = parse_group_by(group_by)
+        return self
 
     def set_sort_order(self, sort_order):
         self.sort_order = sort_order
@@ -109,49 +336,129 @@ class DjangoRepository:
         :param includes:
         :return:
         """
-        if isinstance(includes, str):
-            self.includes = [includes]
-        else:
-            self.includes = includes
+        self.includes = parse_includes(includes)
         return self
 
     def query(self):
+        """
+        Returns the query set for the request with its includes prefetched. Includes matching a
+        snapshot, see magicbox.django.snapshots, can be read from it instead by annotating the
+        query set with `snapshot.annotate` and reading them with `snapshots.load(instance)`.
+
+        :return: QuerySet
+        """
         query = self._modify_query()
         return query
 
-    def _modify_query(self):
+    def _modify_query(self, prefetch=True):
         filters = self.filters
         includes = self.includes
         aggregate = self.aggregate
         sort_orders = self.sort_order
+        group_by = [field for field in self.group_by if self._has_field(field)]
 
         query_set = self.model.objects.get_queryset()
 
         if filters:
-            query_set = DjangoLimiterFactory(query_set).construct_query_set(filters)
+            query_set = DjangoLimiterFactory.for_model(self.model).construct_query_set(filters, query_set)
 
         # If has relations to include pass to factory.
-        if includes:
+        if includes and prefetch and not group_by:
             # @TODO right now this passes back a list for the prefetch object. LimiterFactory and IncludeFactory should work the same way for consistency sake.
-            query_set = query_set.prefetch_related(*DjangoIncludeFactory(self.model).build_prefetch_list(includes))
+            query_set = query_set.prefetch_related(*DjangoIncludeFactory.for_model(self.model).build_prefetch_list(includes))
 
         # APPLY Group by methods if exists
+        if group_by:
+            query_set = query_set.values(*group_by)
 
         # APPLY Aggregate Methods if exists
         if aggregate:
-            aggregation = DjangoAggregatorFactory(self.model).construct_aggregator(aggregate)
+            aggregation = DjangoAggregatorFactory.for_model(self.model).construct_aggregator(aggregate)
             if aggregation:
                 query_set = query_set.annotate(aggregation)
 
-        # APPLY Sort method if exists
+        # APPLY Sort method if exists, grouped rows can only be sorted by their group and aggregate columns.
         if sort_orders:
-            query_set = query_set.order_by(*DjangoSorterFactory(query_set).construct_order_by(sort_orders))
+            columns = group_by + list(query_set.query.annotation_select) if group_by else None
+            sorter_factory = DjangoSorterFactory.for_model(self.model)
+            query_set = query_set.order_by(*sorter_factory.construct_order_by(sort_orders, query_set, columns))
 
-        print(query_set.query)  # @TODO temp, debugging...
         return query_set
 
     def all(self):
-        return self.query().all()
+        """
+        Returns the results. Grouped aggregations come back as a list of dicts, whether they are
+        read from a materialized rollup or the database.
+
+        :return: QuerySet or list
+        """
+        rows = self._rollup_values()
+        if rows is not None:
+            return rows
+
+        query_set = self.query().all()
+        if self.aggregate and self.group_by:
+            return list(query_set)
+
+        return query_set
+
+    def _rollup_values(self):
+        """
+        Answers a grouped aggregation from a materialized rollup when one matches the request.
+        Sorted requests are always answered by the database.
+
+        :return: list or None
+        """
+        if not self.aggregate or not self.group_by or self.sort_order:
+            return None
+
+        return DjangoAggregatorFactory.for_model(self.model).construct_from_rollup(self.aggregate, self.group_by, self.filters)
+
+    def values(self):
+        """
+        Returns the results as a list of dicts with the includes nested under their relation name.
+        Rows are read with `values_list`, so no model instances are created. Includes matching a
+        snapshot are read from it with the rows in a single query. Grouped requests return their
+        group and aggregate columns, without includes.
+
+        :return: list
+        """
+        if [field for field in self.group_by if self._has_field(field)]:
+            return list(self.all())
+
+        query_set = self._modify_query(prefetch=False)
+
+        snapshot = snapshots.find(self.model, self.includes) if self.includes else None
+        if snapshot is not None:
+            return snapshot.construct_values(query_set)
+
+        return DjangoValuesFactory.for_model(self.model).construct_values(query_set, self.includes)
+
+    def dumps(self):
+        """
+        Returns the results of `values` serialized as JSON bytes.
+
+        :return: bytes
+        """
+        return json_dumps(self.values())
+
+    def fingerprint(self, field, pk_fallback=None):
+        """
+        Returns a cheap version of the current query computed in the database, a list of
+        (max of field, count) tuples for the query and each included relation.
+
+        :param field: str - The version field, ex: 'updated_at'
+        :param pk_fallback: bool - Fingerprint included relations without the field by their
+            primary key, defaults to MAGIC_BOX_ETAG_PK_FALLBACK.
+        :return: list or None if an included relation has no version field.
+        """
+        if pk_fallback is None:
+            pk_fallback = get_config().etag_pk_fallback
+
+        query_set = self._modify_query(prefetch=False)
+        return DjangoFingerprintFactory.for_model(self.model).construct_fingerprint(
+            query_set, self.includes, field, pk_fallback
+        )
 
     def save(self):
         pass
@@ -171,13 +478,60 @@ class DjangoRepository:
             if self._has_field(field):
                 setattr(instance, field, value)
 
-        instance.save()
+        with rollups.deferred():
+            instance.save()
 
     def create(self):
         instance = self.model()
         self.fill(instance)
         return instance
 
+    def create_many(self, batch_size=None):
+        """
+        Creates one instance per item of the input with bulk_create, a batch at a time. The input
+        can be any iterable, like the iterator a streamed JSON array or NDJSON body is parsed into,
+        so only one batch is held in memory. All batches are written in one transaction, a body
+        that turns out to be invalid half way creates nothing.
+
+        :param batch_size: int - Defaults to MAGIC_BOX_WRITE_BATCH_SIZE
+        :return: int - The number of created instances.
+        """
+        from django.db import transaction
+
+        batch_size = batch_size or get_config().write_batch_size
+        created = 0
+        batch = []
+
+        with transaction.atomic(), rollups.deferred():
+            for item in self.input or []:
+                if not isinstance(item, dict):
+                    raise parsers.ParseError('Expected an object, got %s.' % type(item).__name__)
+
+                instance = self.model()
+                for field, value in item.items():
+                    if self._has_field(field):
+                        setattr(instance, field, value)
+                batch.append(instance)
+
+                if len(batch) >= batch_size:
+                    created += self._bulk_create(batch)
+                    batch = []
+
+            if batch:
+                created += self._bulk_create(batch)
+
+        return created
+
+    def _bulk_create(self, instances):
+        # bulk_create sends no signals, mark the rollup groups and snapshots of the new rows the way post_save would.
+        self.model._default_manager.bulk_create(instances)
+
+        for instance in instances:
+            rollups.refresh_saved(self.model, instance)
+        snapshots.refresh_created(self.model, instances)
+
+        return len(instances)
+
     # def save(self):
     #     pass
 
@@ -185,7 +539,10 @@ class DjangoRepository:
         if pk:
             return self.delete_one(pk)
 
-        deleted = self.query().delete()
+        from django.db import transaction
+
+        with transaction.atomic(), rollups.deferred():
+            deleted = self.query().delete()
 
         if deleted[0]:
             return deleted
@@ -193,8 +550,11 @@ class DjangoRepository:
             return False
 
     def delete_one(self, pk):
+        from django.db import transaction
+
         try:
-            return self.model.objects.get(pk=pk).delete()
+            with transaction.atomic(), rollups.deferred():
+                return self.model.objects.get(pk=pk).delete()
         except self.model.DoesNotExist:
             return False
 
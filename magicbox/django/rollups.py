@@ -0,0 +1,628 @@
+"""
+Materialized aggregate rollups.
+
+A rollup keeps the result of a grouped aggregation, ex: the count of articles per blog, in the
+AggregateRollup side table. Rollups are declared per model, either in settings:
+
+    MAGIC_BOX_ROLLUPS = {
+        'blog.Article': [
+            {'dimensions': ['blog'], 'aggregations': [('count', 'id')]},
+        ],
+    }
+
+or by calling `register(Article, dimensions=['blog'], aggregations=[('count', 'id')])`.
+
+Groups are maintained from the pre_save, post_save and post_delete signals of the model. A saved
+or deleted row is applied to its groups as a delta: counts and sums are adjusted with F()
+updates, an added row can only raise a max or lower a min, and only removing the row that held
+a min or max has it recomputed from the base table. Groups that are not in the rollup yet are
+computed from the base table. Inside `deferred()` the changes are collected and applied once per
+group when the block exits and its transaction commits, which is how the DjangoRepository write
+paths batch them.
+
+Writes that send no signals, ex: QuerySet.update(), are not seen by the rollups, run the
+magicbox_rebuild_rollups command after them. A rollup is only read after it has been rebuilt
+with its current definition, until then requests are answered from the base table.
+
+DjangoAggregatorFactory answers grouped aggregate requests from a matching rollup instead of
+scanning the base table when the request is not filtered, or filtered to a single group.
+"""
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+from functools import partial
+
+# The alias of the group row that counts the base rows of the group.
+ROWS = ''
+
+# The key of the row rebuild() marks a rollup as built with, group keys are md5 hex digests.
+BUILT = 'built'
+
+_registry = {}
+_local = threading.local()
+
+
+class Rollup:
+    """
+    The definition of a rollup: the model, the fields it is grouped by and the aggregations kept per group.
+    Aggregations are (operation, field) pairs using the operations of DjangoAggregatorFactory.
+
+    Every group is stored as one AggregateRollup row per aggregation plus a ROWS row:
+    count keeps the number of non null values, sum and avg keep it with their sum in number,
+    min and max keep their JSON encoded value.
+    """
+
+    def __init__(self, model, dimensions, aggregations, name=None):
+        self.model = model
+        self.dimensions = tuple(dimensions)
+        self.aggregations = tuple((operation, field) for operation, field in aggregations)
+        self.name = name or '%s:%s' % (model._meta.label_lower, ','.join(self.dimensions))
+        self._output_fields = None
+
+    def __repr__(self):
+        return '<Rollup: %s>' % self.name
+
+    def get_alias(self, operation, field):
+        """
+        Returns the name django gives the aggregation when it is annotated without an alias, ex: 'id__count'.
+        """
+        return '%s__%s' % (field, operation)
+
+    def get_fields(self):
+        """
+        Returns the model fields a row contributes to the rollup with, the dimensions first.
+
+        :return: list of Field
+        """
+        names = list(self.dimensions) + [field for _, field in self.aggregations]
+        return [self.model._meta.get_field(name) for name in dict.fromkeys(names)]
+
+    def get_output_fields(self):
+        """
+        Returns the output field of every aggregation, as django resolves it on the base table,
+        which the stored values are converted back with.
+
+        :return: dict of alias to Field
+        """
+        if self._output_fields is None:
+            query = self.model._default_manager.values(*self.dimensions).annotate(**self.build_aggregations()).query
+            self._output_fields = {alias: query.annotations[alias].output_field for alias in self.build_aggregations()}
+
+        return self._output_fields
+
+    def get_signature(self):
+        """
+        Returns what the rollup is built from, a rollup whose definition changed under the same
+        name has to be rebuilt before it is read.
+
+        :return: str
+        """
+        return json.dumps([self.model._meta.label_lower, list(self.dimensions), [list(pair) for pair in self.aggregations]])
+
+    def get_key(self, values):
+        """
+        Returns the key of a group. Dimension values are hashed as the database stores them, so
+        a filter value and a model attribute of the same group, ex: '2' and 2, get the same key.
+
+        :param values: Dimension values in the order of the dimensions.
+        :return: str
+        """
+        from django.db import connection
+
+        prepared = []
+        for dimension, value in zip(self.dimensions, values):
+            field = self.model._meta.get_field(dimension)
+            prepared.append(field.get_db_prep_value(field.to_python(value), connection))
+
+        return hashlib.md5(json.dumps(prepared, default=str).encode('utf-8')).hexdigest()
+
+    def get_row(self, instance):
+        """
+        Returns the values a model instance contributes to the rollup, keyed by attname.
+
+        :return: dict
+        """
+        return self.to_row({field.attname: getattr(instance, field.attname) for field in self.get_fields()})
+
+    def to_row(self, values):
+        return {field.attname: field.to_python(values[field.attname]) for field in self.get_fields()}
+
+    def get_dimension_values(self, row):
+        """
+        Returns the dimension values of a row, or of a model instance.
+
+        :return: tuple
+        """
+        if not isinstance(row, dict):
+            row = self.get_row(row)
+
+        meta = self.model._meta
+        return tuple(row[meta.get_field(dimension).attname] for dimension in self.dimensions)
+
+    def build_aggregations(self):
+        from magicbox.django.factories import DjangoAggregatorFactory
+        factory = DjangoAggregatorFactory.for_model(self.model)
+
+        return {
+            self.get_alias(operation, field): factory.determine_aggregator(operation, field)
+            for operation, field in self.aggregations
+        }
+
+    def build_stored_aggregations(self):
+        """
+        Returns the aggregations computing the stored columns of a group from the base table.
+
+        :return: dict
+        """
+        from django.db.models import Count, Max, Min, Sum
+
+        aggregations = {'rollup_rows': Count('pk')}
+
+        for operation, field in self.aggregations:
+            alias = self.get_alias(operation, field)
+            if operation == 'min':
+                aggregations[alias] = Min(field)
+            elif operation == 'max':
+                aggregations[alias] = Max(field)
+            else:
+                aggregations[alias + '__rollup_count'] = Count(field)
+                if operation != 'count':
+                    aggregations[alias + '__rollup_sum'] = Sum(field)
+
+        return aggregations
+
+    def build_group(self, values, result):
+        """
+        Returns the AggregateRollup rows of a group from the result of build_stored_aggregations.
+
+        :param values: tuple of dimension values
+        :param result: dict
+        :return: list of AggregateRollup
+        """
+        from magicbox.django.models import AggregateRollup
+
+        key = self.get_key(values)
+        dimensions = self.encode(list(values))
+        group = [AggregateRollup(rollup=self.name, key=key, alias=ROWS, dimensions=dimensions, count=result['rollup_rows'])]
+
+        for operation, field in self.aggregations:
+            alias = self.get_alias(operation, field)
+            stored = AggregateRollup(rollup=self.name, key=key, alias=alias, dimensions=dimensions)
+
+            if operation in ('min', 'max'):
+                stored.value = self.encode(result[alias])
+            else:
+                stored.count = result[alias + '__rollup_count']
+                stored.number = float(result.get(alias + '__rollup_sum') or 0)
+
+            group.append(stored)
+
+        return group
+
+    def encode(self, value):
+        from magicbox.utils import json_dumps
+
+        return None if value is None else json_dumps(value).decode('utf-8')
+
+    def decode(self, field, value):
+        """
+        Converts a stored value back to the type of the field, the way it comes out of the database.
+
+        :param field: Field
+        :param value:
+        :return:
+        """
+        import decimal
+
+        if value is None:
+            return None
+
+        value = field.to_python(value)
+
+        if isinstance(value, decimal.Decimal) and getattr(field, 'decimal_places', None) is not None:
+            value = value.quantize(decimal.Decimal(1).scaleb(-field.decimal_places))
+
+        return value
+
+    def decode_aggregate(self, operation, field, stored):
+        """
+        Returns the value of an aggregation from its stored group row.
+
+        :param operation: str
+        :param field: str
+        :param stored: AggregateRollup
+        :return:
+        """
+        output_field = self.get_output_fields()[self.get_alias(operation, field)]
+
+        if operation == 'count':
+            return stored.count
+        elif operation in ('min', 'max'):
+            value = None if stored.value is None else json.loads(stored.value)
+        elif not stored.count:
+            # SUM and AVG of no values are NULL.
+            value = None
+        elif operation == 'avg':
+            value = stored.number / stored.count
+        else:
+            value = stored.number
+
+        return self.decode(output_field, value)
+
+    def decode_dimensions(self, dimensions):
+        meta = self.model._meta
+        values = json.loads(dimensions)
+
+        return {
+            dimension: self.decode(meta.get_field(dimension), value)
+            for dimension, value in zip(self.dimensions, values)
+        }
+
+    def matches(self, group_by, operation, field):
+        return set(group_by) == set(self.dimensions) and (operation, field) in self.aggregations
+
+    def compute(self, values):
+        """
+        Computes a single group from the base table, replacing what the rollup holds for it.
+
+        :param values: tuple of dimension values
+        :return:
+        """
+        from magicbox.django.models import AggregateRollup
+
+        result = self.model._default_manager \
+            .filter(**dict(zip(self.dimensions, values))) \
+            .aggregate(**self.build_stored_aggregations())
+
+        AggregateRollup.objects.filter(rollup=self.name, key=self.get_key(values)).delete()
+
+        if result['rollup_rows']:
+            AggregateRollup.objects.bulk_create(self.build_group(values, result))
+
+    def collect(self, changes):
+        """
+        Sums up changed rows per group.
+
+        :param changes: iterable of (sign, row), sign 1 for an added row and -1 for a removed one,
+            row as returned by get_row.
+        :return: dict of key to group changes
+        """
+        groups = {}
+
+        for sign, row in changes:
+            values = self.get_dimension_values(row)
+            group = groups.setdefault(self.get_key(values), {
+                'values': values,
+                'rows': 0,
+                'deltas': {},
+                'added': {},
+                'removed': {},
+            })
+            group['rows'] += sign
+
+            for operation, field in self.aggregations:
+                alias = self.get_alias(operation, field)
+                value = row[self.model._meta.get_field(field).attname]
+
+                if value is None:
+                    continue
+
+                if operation in ('min', 'max'):
+                    group['added' if sign > 0 else 'removed'].setdefault(alias, []).append(value)
+                else:
+                    count, number = group['deltas'].get(alias, (0, 0.0))
+                    if operation != 'count':
+                        number += sign * float(value)
+                    group['deltas'][alias] = (count + sign, number)
+
+        return groups
+
+    def refresh_many(self, changes):
+        """
+        Applies changed rows to their groups, see collect.
+
+        :param changes: iterable of (sign, row)
+        :return:
+        """
+        from django.db import transaction
+
+        with transaction.atomic():
+            for key, group in self.collect(changes).items():
+                self.apply(key, group)
+
+    def apply(self, key, group):
+        from django.db.models import F
+        from magicbox.django.models import AggregateRollup
+
+        group_rows = AggregateRollup.objects.filter(rollup=self.name, key=key)
+        stored = {row.alias: row for row in group_rows.select_for_update()}
+
+        if ROWS not in stored:
+            self.compute(group['values'])
+            return
+
+        group_rows.filter(alias=ROWS).update(count=F('count') + group['rows'])
+        if group_rows.filter(alias=ROWS, count__lte=0).exists():
+            group_rows.delete()
+            return
+
+        for alias, (count, number) in group['deltas'].items():
+            group_rows.filter(alias=alias).update(count=F('count') + count, number=F('number') + number)
+
+        recompute = {}
+        for operation, field in self.aggregations:
+            alias = self.get_alias(operation, field)
+            if operation not in ('min', 'max') or alias not in stored:
+                continue
+
+            current = self.decode_aggregate(operation, field, stored[alias])
+            added = group['added'].get(alias, [])
+            removed = group['removed'].get(alias, [])
+
+            if removed and (current is None or any(value == current or value in added for value in removed)):
+                recompute[alias] = (operation, field)
+                continue
+
+            candidates = added + ([] if current is None else [current])
+            if candidates:
+                extreme = min(candidates) if operation == 'min' else max(candidates)
+                if extreme != current:
+                    group_rows.filter(alias=alias).update(value=self.encode(extreme))
+
+        if recompute:
+            self.recompute(group_rows, group['values'], recompute)
+
+    def recompute(self, group_rows, values, aggregations):
+        """
+        Recomputes the min and max aggregations of a group whose extreme row was removed.
+
+        :param group_rows: The AggregateRollup query set of the group.
+        :param values: tuple of dimension values
+        :param aggregations: dict of alias to (operation, field)
+        :return:
+        """
+        from django.db.models import Max, Min
+
+        result = self.model._default_manager \
+            .filter(**dict(zip(self.dimensions, values))) \
+            .aggregate(**{
+                alias: Min(field) if operation == 'min' else Max(field)
+                for alias, (operation, field) in aggregations.items()
+            })
+
+        for alias, value in result.items():
+            group_rows.filter(alias=alias).update(value=self.encode(value))
+
+    def rebuild(self):
+        """
+        Recomputes every group of the rollup with one grouped query over the base table and marks
+        the rollup as built, it is not read before.
+
+        :return: int - The number of groups.
+        """
+        from django.db import transaction
+        from magicbox.django.models import AggregateRollup
+
+        rows = []
+        groups = 0
+        for result in self.model._default_manager.order_by().values(*self.dimensions).annotate(**self.build_stored_aggregations()):
+            rows.extend(self.build_group(tuple(result[dimension] for dimension in self.dimensions), result))
+            groups += 1
+
+        rows.append(AggregateRollup(rollup=self.name, key=BUILT, alias=ROWS, dimensions='[]', value=self.get_signature()))
+
+        with transaction.atomic():
+            AggregateRollup.objects.filter(rollup=self.name).delete()
+            AggregateRollup.objects.bulk_create(rows)
+
+        return groups
+
+    def parse_filters(self, filters):
+        """
+        Converts filters into dimension values to match groups against. Only exact filters on
+        dimensions can be answered by the rollup.
+
+        :param filters: dict
+        :return: dict or None if the filters can not be answered from the rollup.
+        """
+        from magicbox.django.factories import DjangoLimiterFactory
+
+        if not filters:
+            return {}
+
+        limiter_factory = DjangoLimiterFactory.for_model(self.model)
+        matches = {}
+
+        for column, limiter in filters.items():
+            if column not in self.dimensions or not isinstance(limiter, str):
+                return None
+
+            if limiter_factory.determine_limiter(limiter) != ('filter', '', limiter[1:]):
+                return None
+
+            matches[column] = self.model._meta.get_field(column).to_python(limiter[1:])
+
+        return matches
+
+    def read(self, operation, field, filters=None, group_by=None):
+        """
+        Returns the groups of the rollup as the rows `values(*group_by).annotate(aggregation)`
+        returns them. Filters are answered with a lookup of the group's key, so they have to
+        match a single group on every dimension. Rollups are only read once rebuild() built them
+        with their current definition, groups missing until then would silently drop out.
+
+        :param operation: str
+        :param field: str
+        :param filters: dict
+        :param group_by: list - The order of the grouped columns in the rows, defaults to the dimensions.
+        :return: list or None if the rollup is not built or can not answer the filters.
+        """
+        from django.db.models import Q
+        from magicbox.django.models import AggregateRollup
+
+        matches = self.parse_filters(filters)
+        if matches is None or (matches and set(matches) != set(self.dimensions)):
+            return None
+
+        alias = self.get_alias(operation, field)
+        groups = Q(alias=alias)
+
+        if matches:
+            groups &= Q(key=self.get_key([matches[dimension] for dimension in self.dimensions]))
+
+        # The built marker is read with the groups.
+        group_rows = AggregateRollup.objects.filter(Q(key=BUILT) | groups, rollup=self.name).order_by('pk')
+
+        built = False
+        rows = []
+        for stored in group_rows:
+            if stored.key == BUILT:
+                built = stored.value == self.get_signature()
+                continue
+
+            dimensions = self.decode_dimensions(stored.dimensions)
+            row = {column: dimensions[column] for column in (group_by or self.dimensions)}
+            row[alias] = self.decode_aggregate(operation, field, stored)
+            rows.append(row)
+
+        return rows if built else None
+
+
+def register(model, dimensions, aggregations, name=None):
+    """
+    Registers a rollup for the model and connects the signals that keep it up to date.
+
+    :param model: A Django model
+    :param dimensions: list of field names to group by
+    :param aggregations: list of (operation, field) pairs
+    :param name: Optional name, defaults to '<app_label>.<model_name>:<dimensions>'
+    :return: Rollup
+    """
+    from django.db.models import signals
+
+    rollup = Rollup(model, dimensions, aggregations, name)
+
+    if model not in _registry:
+        _registry[model] = []
+        dispatch_uid = 'magicbox.rollups.%s' % model._meta.label_lower
+        signals.pre_save.connect(capture_previous, sender=model, dispatch_uid=dispatch_uid)
+        signals.post_save.connect(refresh_saved, sender=model, dispatch_uid=dispatch_uid)
+        signals.post_delete.connect(refresh_deleted, sender=model, dispatch_uid=dispatch_uid)
+
+    _registry[model] = [registered for registered in _registry[model] if registered.name != rollup.name]
+    _registry[model].append(rollup)
+
+    return rollup
+
+
+def register_from_settings():
+    from django.apps import apps
+    from magicbox.django.conf import get_config
+
+    for label, definitions in get_config().rollups.items():
+        model = apps.get_model(label)
+        for definition in definitions:
+            register(model, **definition)
+
+
+def unregister(model):
+    from django.db.models import signals
+
+    if _registry.pop(model, None) is not None:
+        dispatch_uid = 'magicbox.rollups.%s' % model._meta.label_lower
+        signals.pre_save.disconnect(sender=model, dispatch_uid=dispatch_uid)
+        signals.post_save.disconnect(sender=model, dispatch_uid=dispatch_uid)
+        signals.post_delete.disconnect(sender=model, dispatch_uid=dispatch_uid)
+
+
+def get_rollups(model=None):
+    if model is not None:
+        return list(_registry.get(model, []))
+
+    return [rollup for rollups in _registry.values() for rollup in rollups]
+
+
+def find(model, group_by, operation, field):
+    """
+    Returns the first rollup of the model that answers the grouped aggregation, or None.
+    """
+    for rollup in _registry.get(model, []):
+        if rollup.matches(group_by, operation, field):
+            return rollup
+
+    return None
+
+
+@contextmanager
+def deferred():
+    """
+    Collects the changes marked inside the block and applies them when the outermost block exits.
+    Include snapshots, see magicbox.django.snapshots, are collected the same way: anything marked dirty
+    has its `refresh_many` called once with the list of keys marked for it.
+
+    The changes are only applied when the block exits normally, and then on commit of the
+    transaction it runs in, so writes that are rolled back never reach the rollups. Wrap the block
+    in `transaction.atomic()`, not the other way around, for its writes to roll back with it.
+    """
+    from django.db import transaction
+
+    depth = getattr(_local, 'depth', 0)
+    if depth == 0:
+        _local.dirty = {}
+
+    _local.depth = depth + 1
+    try:
+        yield
+    except BaseException:
+        if _local.depth == 1:
+            _local.dirty = None
+        raise
+    finally:
+        _local.depth -= 1
+
+    if _local.depth == 0:
+        dirty, _local.dirty = _local.dirty, None
+        for target, keys in dirty.items():
+            transaction.on_commit(partial(target.refresh_many, keys))
+
+
+def mark_dirty(target, key):
+    if getattr(_local, 'depth', 0):
+        _local.dirty.setdefault(target, []).append(key)
+    else:
+        target.refresh_many([key])
+
+
+def capture_previous(sender, instance, **kwargs):
+    """
+    Remembers the stored values of a row before it is saved, so its old contribution can be removed from its groups.
+    """
+    instance._magicbox_rollup_previous = None
+
+    if instance._state.adding or instance.pk is None:
+        return
+
+    attnames = sorted(set(field.attname for rollup in _registry.get(sender, []) for field in rollup.get_fields()))
+    instance._magicbox_rollup_previous = sender._default_manager.filter(pk=instance.pk).values(*attnames).first()
+
+
+def refresh_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_magicbox_rollup_previous', None)
+    instance._magicbox_rollup_previous = None
+
+    for rollup in _registry.get(sender, []):
+        row = rollup.get_row(instance)
+
+        if previous is not None:
+            previous_row = rollup.to_row(previous)
+            if previous_row == row:
+                continue
+            mark_dirty(rollup, (-1, previous_row))
+
+        mark_dirty(rollup, (1, row))
+
+
+def refresh_deleted(sender, instance, **kwargs):
+    for rollup in _registry.get(sender, []):
+        mark_dirty(rollup, (-1, rollup.get_row(instance)))
@@ -0,0 +1,394 @@
+"""
+Denormalized include snapshots.
+
+A snapshot keeps the serialized includes of every row of a model, ex: the articles and their
+comments of each person, in the IncludeSnapshot side table. Snapshots are declared per model,
+either in settings:
+
+    MAGIC_BOX_SNAPSHOTS = {
+        'blog.Person': [
+            {'includes': ['articles.comments']},
+        ],
+    }
+
+or by calling `register(Person, includes=['articles.comments'])`.
+
+DjangoRepository.values() and dumps() answer requests whose includes match a snapshot from it:
+the snapshot is joined onto the root rows as a subquery annotation, so the whole include tree is
+read with one query instead of one query per relation. Rows that have no snapshot yet fall back
+to reading their includes from the relations. query() and all() keep prefetching the includes,
+a query set can opt into the snapshot with `Snapshot.annotate` and `load`.
+
+Snapshots are refreshed from the signals of every model in the include tree. A changed row marks
+the root rows that include it, before and after the change, and only those are rebuilt. The
+refreshes are batched with `magicbox.django.rollups.deferred`, which the DjangoRepository write
+paths already use.
+"""
+import json
+
+from magicbox.django.rollups import deferred, mark_dirty
+
+# The name of the annotation the snapshot is read into.
+ANNOTATION = 'magicbox_snapshot'
+
+_registry = {}
+_dependents = {}
+
+
+class Snapshot:
+    """
+    The definition of a snapshot: the model and the relationship chains it keeps serialized per row.
+    """
+
+    def __init__(self, model, includes, name=None):
+        from magicbox.django.factories import DjangoValuesFactory
+
+        self.model = model
+        self.includes = list(includes)
+        self.tree = DjangoValuesFactory.for_model(model).build_include_tree(self.includes)
+        self.name = name or '%s:%s' % (model._meta.label_lower, ','.join(sorted(self.includes)))
+
+    def __repr__(self):
+        return '<Snapshot: %s>' % self.name
+
+    def matches(self, includes):
+        from magicbox.django.factories import DjangoValuesFactory
+
+        return bool(includes) and DjangoValuesFactory.for_model(self.model).build_include_tree(includes) == self.tree
+
+    def get_dependencies(self):
+        """
+        Returns the models in the include tree with the lookup that finds the root rows including
+        one of their rows, ex: (Comment, 'articles__comments__pk'). The model itself is included as (model, 'pk').
+
+        :return: list of (model, lookup)
+        """
+        dependencies = [(self.model, 'pk')]
+
+        def walk(model, tree, path):
+            for name, subtree in tree.items():
+                related_model = model._meta.get_field(name).related_model
+                dependencies.append((related_model, '__'.join(path + [name, 'pk'])))
+                walk(related_model, subtree, path + [name])
+
+        walk(self.model, self.tree, [])
+        return dependencies
+
+    def find_roots(self, lookup, pks):
+        """
+        Returns the primary keys of the root rows whose snapshot contains one of the given rows.
+
+        :param lookup: str - As returned by get_dependencies.
+        :param pks: list
+        :return: set
+        """
+        if lookup == 'pk':
+            return set(pks)
+
+        return set(self.model._default_manager.filter(**{lookup + '__in': pks}).values_list('pk', flat=True))
+
+    def serialize(self, row):
+        from magicbox.utils import json_dumps
+
+        return json_dumps({name: row[name] for name in self.tree}).decode('utf-8')
+
+    def build(self, pks):
+        """
+        Reads the includes of the given root rows from their relations.
+
+        :param pks: list
+        :return: list of IncludeSnapshot
+        """
+        from magicbox.django.factories import DjangoValuesFactory
+        from magicbox.django.models import IncludeSnapshot
+
+        pk_name = self.model._meta.pk.attname
+        query_set = self.model._default_manager.filter(pk__in=pks)
+
+        return [
+            IncludeSnapshot(snapshot=self.name, key=str(row[pk_name]), data=self.serialize(row))
+            for row in DjangoValuesFactory.for_model(self.model).construct_values(query_set, self.includes)
+        ]
+
+    def save(self, built):
+        """
+        Inserts or updates built snapshots in place, so concurrent refreshes of the same row do
+        not conflict on its key. Stored snapshots are locked and only updated when their data
+        changed, the rest are inserted in one query.
+
+        :param built: list of IncludeSnapshot
+        :return:
+        """
+        from django.db import IntegrityError, transaction
+        from magicbox.django.models import IncludeSnapshot
+
+        built = {snapshot.key: snapshot for snapshot in built}
+
+        with transaction.atomic():
+            stored = IncludeSnapshot.objects \
+                .select_for_update() \
+                .filter(snapshot=self.name, key__in=list(built)) \
+                .values_list('key', 'data')
+
+            for key, data in stored:
+                snapshot = built.pop(key)
+                if snapshot.data != data:
+                    IncludeSnapshot.objects.filter(snapshot=self.name, key=key).update(data=snapshot.data)
+
+            try:
+                with transaction.atomic():
+                    IncludeSnapshot.objects.bulk_create(list(built.values()))
+            except IntegrityError:
+                # A concurrent refresh inserted some of the same rows first.
+                for key, snapshot in built.items():
+                    IncludeSnapshot.objects.update_or_create(
+                        snapshot=self.name, key=key, defaults={'data': snapshot.data}
+                    )
+
+    def refresh_many(self, pks):
+        """
+        Rebuilds the snapshot of the given root rows, removing it for rows that no longer exist.
+
+        :param pks: iterable of primary keys
+        :return:
+        """
+        from django.db import transaction
+        from magicbox.django.conf import get_config
+        from magicbox.django.models import IncludeSnapshot
+
+        pks = list(set(pks))
+        batch_size = get_config().write_batch_size
+
+        with transaction.atomic():
+            for start in range(0, len(pks), batch_size):
+                built = self.build(pks[start:start + batch_size])
+                self.save(built)
+
+                removed = set(str(pk) for pk in pks[start:start + batch_size]) - set(row.key for row in built)
+                if removed:
+                    IncludeSnapshot.objects.filter(snapshot=self.name, key__in=removed).delete()
+
+    def rebuild(self):
+        """
+        Rebuilds the snapshot of every row of the model and removes the snapshots of rows that no longer exist.
+
+        :return: int - The number of rows.
+        """
+        from django.db import transaction
+        from django.db.models import CharField
+        from django.db.models.functions import Cast
+        from magicbox.django.conf import get_config
+        from magicbox.django.models import IncludeSnapshot
+
+        batch_size = get_config().write_batch_size
+        pks = list(self.model._default_manager.order_by().values_list('pk', flat=True))
+
+        with transaction.atomic():
+            for start in range(0, len(pks), batch_size):
+                self.save(self.build(pks[start:start + batch_size]))
+
+            keys = self.model._default_manager.order_by().annotate(
+                snapshot_key=Cast('pk', output_field=CharField())
+            ).values('snapshot_key')
+            IncludeSnapshot.objects.filter(snapshot=self.name).exclude(key__in=keys).delete()
+
+        return len(pks)
+
+    def get_annotation(self):
+        """
+        Returns the subquery that reads a row's snapshot, to be annotated as ANNOTATION.
+        """
+        from django.db.models import CharField, OuterRef, Subquery
+        from django.db.models.functions import Cast
+        from magicbox.django.models import IncludeSnapshot
+
+        snapshots = IncludeSnapshot.objects \
+            .filter(snapshot=self.name, key=Cast(OuterRef('pk'), output_field=CharField())) \
+            .values('data')[:1]
+
+        return Subquery(snapshots, output_field=CharField())
+
+    def annotate(self, query_set):
+        return query_set.annotate(**{ANNOTATION: self.get_annotation()})
+
+    def construct_values(self, query_set):
+        """
+        Evaluates the query set like `DjangoValuesFactory.construct_values` with the includes read
+        from the snapshot. Rows without a snapshot have their includes read from the relations.
+        Included values come back JSON decoded, ex: datetimes as ISO strings, so `json_dumps` of
+        the result is the same either way.
+
+        :param query_set: A query set of the model, not annotated yet.
+        :return: list
+        """
+        from magicbox.django.factories import DjangoValuesFactory
+
+        factory = DjangoValuesFactory.for_model(self.model)
+        rows = factory.construct_values(self.annotate(query_set))
+        missing = []
+
+        for row in rows:
+            data = row.pop(ANNOTATION)
+            if data is None:
+                missing.append(row)
+            else:
+                row.update(json.loads(data))
+
+        factory.attach_relations(self.model, missing, self.tree)
+
+        return rows
+
+
+def load(instance):
+    """
+    Returns the decoded includes of an instance read through a snapshot annotated query set,
+    or None if the instance has no snapshot.
+
+    :param instance: A model instance from a query set annotated with `Snapshot.annotate`
+    :return: dict
+    """
+    data = getattr(instance, ANNOTATION, None)
+
+    if data is None:
+        return None
+
+    return json.loads(data)
+
+
+def register(model, includes, name=None):
+    """
+    Registers a snapshot for the model and connects the signals that keep it up to date.
+
+    :param model: A Django model
+    :param includes: list of relationship chains, ex: ['articles.comments']
+    :param name: Optional name, defaults to '<app_label>.<model_name>:<includes>'
+    :return: Snapshot
+    """
+    snapshot = Snapshot(model, includes, name)
+
+    _registry[model] = [registered for registered in _registry.get(model, []) if registered.name != snapshot.name]
+    _registry[model].append(snapshot)
+    connect_dependents()
+
+    return snapshot
+
+
+def register_from_settings():
+    from django.apps import apps
+    from magicbox.django.conf import get_config
+
+    for label, definitions in get_config().snapshots.items():
+        model = apps.get_model(label)
+        for definition in definitions:
+            register(model, **definition)
+
+
+def unregister(model):
+    if _registry.pop(model, None) is not None:
+        connect_dependents()
+
+
+def connect_dependents():
+    """
+    Connects the signals of every model a registered snapshot depends on, and disconnects the rest.
+    """
+    from django.db.models import signals
+
+    dependents = {}
+    for snapshots in _registry.values():
+        for snapshot in snapshots:
+            for model, lookup in snapshot.get_dependencies():
+                dependents.setdefault(model, []).append((snapshot, lookup))
+
+    for model in set(_dependents) - set(dependents):
+        dispatch_uid = 'magicbox.snapshots.%s' % model._meta.label_lower
+        signals.pre_save.disconnect(sender=model, dispatch_uid=dispatch_uid)
+        signals.post_save.disconnect(sender=model, dispatch_uid=dispatch_uid)
+        signals.pre_delete.disconnect(sender=model, dispatch_uid=dispatch_uid)
+        signals.post_delete.disconnect(sender=model, dispatch_uid=dispatch_uid)
+
+    for model in set(dependents) - set(_dependents):
+        dispatch_uid = 'magicbox.snapshots.%s' % model._meta.label_lower
+        signals.pre_save.connect(capture_previous, sender=model, dispatch_uid=dispatch_uid)
+        signals.post_save.connect(refresh_saved, sender=model, dispatch_uid=dispatch_uid)
+        signals.pre_delete.connect(capture_deleted, sender=model, dispatch_uid=dispatch_uid)
+        signals.post_delete.connect(refresh_deleted, sender=model, dispatch_uid=dispatch_uid)
+
+    _dependents.clear()
+    _dependents.update(dependents)
+
+
+def get_snapshots(model=None):
+    if model is not None:
+        return list(_registry.get(model, []))
+
+    return [snapshot for snapshots in _registry.values() for snapshot in snapshots]
+
+
+def find(model, includes):
+    """
+    Returns the first snapshot of the model that holds exactly the given includes, or None.
+    """
+    for snapshot in _registry.get(model, []):
+        if snapshot.matches(includes):
+            return snapshot
+
+    return None
+
+
+def find_roots(sender, pks):
+    """
+    Returns the root rows of every snapshot that contains one of the given rows of sender.
+
+    :return: list of (snapshot, set of primary keys)
+    """
+    pks = [pk for pk in pks if pk is not None]
+
+    if not pks:
+        return []
+
+    return [(snapshot, snapshot.find_roots(lookup, pks)) for snapshot, lookup in _dependents.get(sender, [])]
+
+
+def mark_roots(roots):
+    with deferred():
+        for snapshot, pks in roots:
+            for pk in pks:
+                mark_dirty(snapshot, pk)
+
+
+def capture_previous(sender, instance, **kwargs):
+    """
+    Remembers the root rows that included a row before it is saved, so moving it to another parent refreshes both.
+    """
+    if instance._state.adding or instance.pk is None:
+        return
+
+    instance._magicbox_snapshot_roots = find_roots(sender, [instance.pk])
+
+
+def capture_deleted(sender, instance, **kwargs):
+    # The roots have to be found before the row, and possibly its parents, are gone.
+    instance._magicbox_snapshot_roots = find_roots(sender, [instance.pk])
+
+
+def refresh_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_magicbox_snapshot_roots', [])
+    instance._magicbox_snapshot_roots = []
+
+    mark_roots(previous + find_roots(sender, [instance.pk]))
+
+
+def refresh_deleted(sender, instance, **kwargs):
+    previous = getattr(instance, '_magicbox_snapshot_roots', [])
+    instance._magicbox_snapshot_roots = []
+
+    mark_roots(previous)
+
+
+def refresh_created(sender, instances):
+    """
+    Marks the snapshots that include rows created with bulk_create, which sends no signals.
+    Finds the roots of all instances with one query per snapshot.
+    """
+    mark_roots(find_roots(sender, [instance.pk for instance in instances]))
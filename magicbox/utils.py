@@ -1,3 +1,9 @@
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
 def parse_qsl_with_brackets(qs_lists):
     """
 
@@ -8,7 +14,7 @@ def parse_qsl_with_brackets(qs_lists):
     parsed_params = {}
 
     for param, values in qs_lists:
-        base = param[:param.find('[')]
+        base = param.split('[', 1)[0]
         nested_params = re.findall(r'\[(.+?)\]', param)
         nested_len = len(nested_params)
 
@@ -38,5 +44,38 @@ def parse_qsl_with_brackets(qs_lists):
             # Move current cursor
             current = current[key]
 
-    print(parsed_params)
     return parsed_params
+
+
+def _json_default(obj):
+    """
+    Converts the values that come out of a database row but are not natively JSON serializable.
+
+    :param obj:
+    :return:
+    """
+    import datetime
+    import decimal
+    import uuid
+
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+
+def json_dumps(data):
+    """
+    Serializes data into JSON bytes. Uses orjson when it is installed and falls back to the
+    standard library json module otherwise.
+
+    :param data:
+    :return: bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default)
+
+    import json
+    return json.dumps(data, default=_json_default, separators=(',', ':')).encode('utf-8')
@@ -55,8 +55,13 @@ def run_setup():
             author="Kirill Fuchs",
             author_email="kfuchs@fuzzproductions.com",
             license="MIT License",
-            packages=['magicbox', 'tests'],
+            packages=['magicbox', 'magicbox.django', 'magicbox.django.migrations', 'magicbox.django.management',
+                      'magicbox.django.management.commands', 'tests'],
             platforms=['any'],
+            extras_require={
+                # The oldest Django magicbox.django supports, requirements.txt pins the one it is developed on.
+                'django': ['Django>=1.11'],
+            },
             **kw)
 
 
@@ -1,9 +1,47 @@
 import os
 
 import django
-from django.test import SimpleTestCase
+from django.apps import apps
+from django.test import SimpleTestCase, TestCase
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.django.django_settings')
 
-django.setup()
+if not apps.ready and not apps.loading:
+    django.setup()
 MagicBoxTestCase = SimpleTestCase
+
+_test_database_created = False
+
+
+def create_test_database():
+    """
+    Creates the test database once per process, the test runner is not required to do it.
+    The fixture models live outside of a models module, so migrate skips them and their tables are created here.
+    """
+    global _test_database_created
+    from django.db import connection
+    from tests.django.fixtures import models
+
+    if _test_database_created:
+        return
+
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+    existing = set(connection.introspection.table_names())
+    with connection.schema_editor() as schema_editor:
+        for model in apps.get_app_config('django').get_models():
+            if model._meta.db_table not in existing:
+                schema_editor.create_model(model)
+
+    _test_database_created = True
+
+
+class MagicBoxDatabaseTestCase(TestCase):
+    """
+    A TestCase against an in memory SQLite database, every test runs in a transaction that is rolled back.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        create_test_database()
+        super().setUpClass()
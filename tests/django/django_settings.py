@@ -1,10 +1,12 @@
 SECRET_KEY = 'fake-key'
 INSTALLED_APPS = [
+    'magicbox.django',
     'tests.django',
 ]
 
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.sqlite3',
-#     }
-# }
\ No newline at end of file
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
@@ -15,8 +15,19 @@ class Article(models.Model):
     title = models.CharField(max_length=255)
     author = models.ForeignKey(Person, on_delete=models.CASCADE, related_name='articles')
     blog = models.ForeignKey(Blog, on_delete=models.CASCADE, related_name='articles')
+    updated_at = models.DateTimeField(auto_now=True)
 
 
 class Comment(models.Model):
     text = models.CharField(max_length=255)
     article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='comments')
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=30)
+    articles = models.ManyToManyField(Article, related_name='tags')
+
+
+class Profile(models.Model):
+    bio = models.CharField(max_length=255)
+    person = models.OneToOneField(Person, on_delete=models.CASCADE, related_name='profile')
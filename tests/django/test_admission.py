@@ -0,0 +1,147 @@
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from magicbox.django import admission
+from magicbox.django.repository import DjangoRepository, resource
+from tests.django import MagicBoxTestCase as TestCase
+from tests.django.fixtures.models import Person
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLocalMemoryBackend(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.backend = admission.LocalMemoryBackend(max_heavy=1, clock=self.clock)
+
+    def test_can_consume_until_bucket_is_empty(self):
+        self.assertEqual(self.backend.consume('client', 6, rate=2, burst=10), 0)
+        self.assertEqual(self.backend.consume('client', 4, rate=2, burst=10), 0)
+        self.assertEqual(self.backend.consume('client', 3, rate=2, burst=10), 1.5)
+
+    def test_bucket_refills_over_time(self):
+        self.backend.consume('client', 10, rate=2, burst=10)
+        self.clock.now += 2
+
+        self.assertEqual(self.backend.consume('client', 4, rate=2, burst=10), 0)
+        self.assertGreater(self.backend.consume('client', 1, rate=2, burst=10), 0)
+
+    def test_buckets_are_per_client(self):
+        self.backend.consume('client', 10, rate=2, burst=10)
+
+        self.assertEqual(self.backend.consume('other', 10, rate=2, burst=10), 0)
+
+    def test_heavy_slots_are_limited(self):
+        self.assertTrue(self.backend.acquire(timeout=0))
+        self.assertFalse(self.backend.acquire(timeout=0))
+        self.backend.release()
+        self.assertTrue(self.backend.acquire(timeout=0))
+
+
+class TestCacheBackend(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.clock = FakeClock()
+        self.backend = admission.CacheBackend(max_heavy=1, clock=self.clock)
+
+    def test_can_consume_until_bucket_is_empty(self):
+        self.assertEqual(self.backend.consume('client', 10, rate=2, burst=10), 0)
+        self.assertEqual(self.backend.consume('client', 1, rate=2, burst=10), 0.5)
+
+    def test_heavy_slots_are_limited(self):
+        slot = self.backend.acquire(timeout=0)
+
+        self.assertTrue(slot)
+        self.assertFalse(self.backend.acquire(timeout=0))
+        self.backend.release(slot)
+        self.assertTrue(self.backend.acquire(timeout=0))
+
+    def test_released_slot_is_only_freed_once(self):
+        backend = admission.CacheBackend(max_heavy=2, clock=self.clock)
+        slot = backend.acquire(timeout=0)
+        backend.acquire(timeout=0)
+
+        backend.release(slot)
+        backend.release(slot)
+
+        self.assertTrue(backend.acquire(timeout=0))
+        self.assertFalse(backend.acquire(timeout=0))
+
+    def test_expired_slot_frees_only_itself(self):
+        from django.core.cache import cache
+
+        backend = admission.CacheBackend(max_heavy=2, clock=self.clock)
+        expired = backend.acquire(timeout=0)
+        backend.acquire(timeout=0)
+
+        # As if the holder died and its slot timed out.
+        cache.delete(expired[0])
+
+        self.assertTrue(backend.acquire(timeout=0))
+        self.assertFalse(backend.acquire(timeout=0))
+
+        # The late release of the expired slot does not free the slot claimed since.
+        backend.release(expired)
+        self.assertFalse(backend.acquire(timeout=0))
+
+
+class TestEstimateCost(TestCase):
+    def test_unfiltered_listing_costs_more(self):
+        listing = DjangoRepository(Person)
+        filtered = DjangoRepository(Person).set_filters({'first_name': '=kirill'})
+
+        self.assertGreater(admission.estimate_cost(listing), admission.estimate_cost(filtered))
+
+    def test_include_depth_adds_cost(self):
+        shallow = DjangoRepository(Person).set_includes('articles')
+        deep = DjangoRepository(Person).set_includes('articles.comments')
+
+        self.assertEqual(admission.estimate_cost(deep) - admission.estimate_cost(shallow), admission.INCLUDE_COST)
+
+    def test_can_count_nested_filters(self):
+        self.assertEqual(admission.count_filters({'a': '=1', 'or': {'b': '=2', 'and': {'c': '=3'}}}), 3)
+        self.assertEqual(admission.count_filters(None), 0)
+
+
+@resource(Person)
+def person_view(request, repository):
+    return HttpResponse('ok')
+
+
+class TestResourceAdmission(TestCase):
+    def setUp(self):
+        self.request_factory = RequestFactory()
+
+    def test_admission_is_off_by_default(self):
+        self.assertIsNone(admission.get_controller())
+
+    @override_settings(MAGIC_BOX_ADMISSION={'enabled': True, 'rate': 0.5, 'burst': 8})
+    def test_can_throttle_client(self):
+        request = self.request_factory.get('/people/', REMOTE_ADDR='10.0.0.1')
+
+        self.assertEqual(person_view(request).status_code, 200)
+        self.assertEqual(person_view(request).status_code, 200)
+
+        response = person_view(request)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '8')
+
+        other_request = self.request_factory.get('/people/', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(person_view(other_request).status_code, 200)
+
+    @override_settings(MAGIC_BOX_ADMISSION={'enabled': True, 'heavy_cost': 1, 'max_heavy': 1, 'queue_timeout': 0})
+    def test_can_shed_heavy_requests(self):
+        controller = admission.get_controller()
+        request = self.request_factory.get('/people/')
+
+        self.assertTrue(controller.admit(request, DjangoRepository(Person)))
+        self.assertEqual(person_view(request).status_code, 429)
+
+        controller.release(True)
+        self.assertEqual(person_view(request).status_code, 200)
@@ -0,0 +1,56 @@
+import subprocess
+import sys
+
+from django.test import override_settings
+from magicbox.django.conf import ConfigAttribute, get_config
+from magicbox.django.factories import DjangoIncludeFactory
+from tests.django import MagicBoxTestCase as TestCase
+from tests.django.fixtures.models import Person
+
+
+class TestConfig(TestCase):
+    def test_can_resolve_defaults(self):
+        config = get_config()
+
+        self.assertEqual(config.relation_delimiter, '.')
+        self.assertEqual(config.filters_param, 'filters')
+        self.assertEqual(config.etag_field, 'updated_at')
+
+    def test_config_is_resolved_once(self):
+        self.assertIs(get_config(), get_config())
+
+    def test_config_is_frozen(self):
+        with self.assertRaises(AttributeError):
+            get_config().filters_param = 'where'
+
+    def test_config_is_refreshed_when_setting_changes(self):
+        with override_settings(MAGIC_BOX_FILTERS_PARAM='where'):
+            self.assertEqual(get_config().filters_param, 'where')
+
+        self.assertEqual(get_config().filters_param, 'filters')
+
+    def test_config_attribute_reads_config(self):
+        class Factory:
+            RELATION_DELIMITER = ConfigAttribute('relation_delimiter')
+
+        with override_settings(MAGIC_BOX_RELATION_DELIMITER='/'):
+            self.assertEqual(Factory.RELATION_DELIMITER, '/')
+            self.assertEqual(DjangoIncludeFactory(Person).parse_include('articles/comments'), 'articles__comments')
+
+        self.assertEqual(Factory().RELATION_DELIMITER, '.')
+
+
+class TestLazyImport(TestCase):
+    def test_import_does_not_load_orm_or_settings(self):
+        """
+        Tests if importing the repository works without configured settings and does not load the ORM.
+        """
+        code = (
+            'import os, sys\n'
+            'os.environ.pop("DJANGO_SETTINGS_MODULE", None)\n'
+            'import magicbox.django.repository\n'
+            'from magicbox.django import resource, DjangoRepository\n'
+            'assert "django.db.models" not in sys.modules\n'
+        )
+
+        subprocess.check_call([sys.executable, '-c', code])
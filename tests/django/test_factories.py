@@ -1,8 +1,8 @@
 from django.db.models import Prefetch
 from magicbox.django.factories import DjangoIncludeFactory, DjangoAggregatorFactory, DjangoLimiterFactory, \
-    DjangoSorterFactory
-from tests.django import MagicBoxTestCase as TestCase
-from tests.django.fixtures.models import Person, Blog
+    DjangoSorterFactory, DjangoValuesFactory
+from tests.django import MagicBoxDatabaseTestCase, MagicBoxTestCase as TestCase
+from tests.django.fixtures.models import Person, Blog, Article, Comment, Profile, Tag
 
 
 class TestDjangoIncludeFactory(TestCase):
@@ -150,6 +150,141 @@ class TestDjangoIncludeFactory(TestCase):
         self.assertEquals(len(prefetch_list), 0)
 
 
+class TestDjangoValuesFactory(TestCase):
+    def setUp(self):
+        self.factory = DjangoValuesFactory
+
+    def test_can_init(self):
+        """
+        Tests if factory can be initialized.
+        """
+        instance = self.factory(Person)
+
+        self.assertIsInstance(instance, self.factory)
+
+    def test_can_build_include_tree(self):
+        """
+        Tests if build_include_tree will merge relationship chains into a nested dict.
+
+            Given
+                A list of includes: "['articles.comments', 'articles.blog', 'blog']"
+            When
+                I try to build the include tree
+            Then
+                I should get back: {'articles': {'comments': {}, 'blog': {}}, 'blog': {}}
+        """
+        instance = self.factory(Person)
+        delimiter = DjangoIncludeFactory.RELATION_DELIMITER
+        includes = ['articles' + delimiter + 'comments', 'articles' + delimiter + 'blog', 'blog']
+
+        self.assertEqual(instance.build_include_tree(includes), {
+            'articles': {'comments': {}, 'blog': {}},
+            'blog': {},
+        })
+
+    def test_can_build_include_tree_without_invalid_relationships(self):
+        """
+        Tests if build_include_tree will drop invalid relationships.
+
+            Given
+                A list of includes: "['not_a_real.relationship', 'articles.invalid_relationship']"
+            When
+                I try to build the include tree
+            Then
+                I should get back: {'articles': {}}
+        """
+        instance = self.factory(Person)
+        delimiter = DjangoIncludeFactory.RELATION_DELIMITER
+        includes = ['not_a_real' + delimiter + 'relationship', 'articles' + delimiter + 'invalid_relationship']
+
+        self.assertEqual(instance.build_include_tree(includes), {'articles': {}})
+
+    def test_can_get_columns(self):
+        """
+        Tests if get_columns returns the concrete columns with foreign keys by attname.
+        """
+        instance = self.factory(Person)
+
+        self.assertEqual(instance.get_columns(Person), ['id', 'first_name', 'last_name', 'blog_id'])
+
+
+class TestDjangoValuesFactoryQueries(MagicBoxDatabaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.blog = Blog.objects.create(name='blog')
+        cls.kirill = Person.objects.create(first_name='kirill', last_name='f', blog=cls.blog)
+        cls.joe = Person.objects.create(first_name='joe', last_name='m', blog=cls.blog)
+        cls.first = Article.objects.create(title='first', author=cls.kirill, blog=cls.blog)
+        cls.second = Article.objects.create(title='second', author=cls.kirill, blog=cls.blog)
+        Comment.objects.create(text='one', article=cls.first)
+        Comment.objects.create(text='two', article=cls.first)
+        tag = Tag.objects.create(name='tag')
+        tag.articles.add(cls.first, cls.second)
+        Profile.objects.create(bio='bio', person=cls.kirill)
+
+    def test_can_construct_values(self):
+        with self.assertNumQueries(1):
+            rows = DjangoValuesFactory(Person).construct_values(Person.objects.order_by('pk'))
+
+        self.assertEqual(rows, [
+            {'id': self.kirill.pk, 'first_name': 'kirill', 'last_name': 'f', 'blog_id': self.blog.pk},
+            {'id': self.joe.pk, 'first_name': 'joe', 'last_name': 'm', 'blog_id': self.blog.pk},
+        ])
+
+    def test_can_attach_reverse_relations_with_one_query_per_relation(self):
+        """
+        Tests if every relation in the include tree costs exactly one query.
+
+            Given
+                People with articles that have comments
+            When
+                I construct values with include 'articles.comments'
+            Then
+                Three queries run and the comments are nested under their articles
+        """
+        includes = ['articles' + DjangoIncludeFactory.RELATION_DELIMITER + 'comments']
+
+        with self.assertNumQueries(3):
+            rows = DjangoValuesFactory(Person).construct_values(Person.objects.order_by('pk'), includes)
+
+        self.assertEqual([article['title'] for article in rows[0]['articles']], ['first', 'second'])
+        self.assertEqual([comment['text'] for comment in rows[0]['articles'][0]['comments']], ['one', 'two'])
+        self.assertEqual(rows[0]['articles'][1]['comments'], [])
+        self.assertEqual(rows[1]['articles'], [])
+
+    def test_can_attach_forward_relations(self):
+        with self.assertNumQueries(2):
+            rows = DjangoValuesFactory(Article).construct_values(Article.objects.order_by('pk'), ['author'])
+
+        self.assertEqual(rows[0]['author']['first_name'], 'kirill')
+        self.assertIs(rows[0]['author'], rows[1]['author'])
+
+    def test_can_attach_many_to_many_relations(self):
+        with self.assertNumQueries(2):
+            tags = DjangoValuesFactory(Tag).construct_values(Tag.objects.all(), ['articles'])
+        with self.assertNumQueries(2):
+            articles = DjangoValuesFactory(Article).construct_values(Article.objects.order_by('pk'), ['tags'])
+
+        self.assertEqual(sorted(article['title'] for article in tags[0]['articles']), ['first', 'second'])
+        self.assertEqual([[tag['name'] for tag in article['tags']] for article in articles], [['tag'], ['tag']])
+
+    def test_can_attach_one_to_one_relations(self):
+        with self.assertNumQueries(2):
+            people = DjangoValuesFactory(Person).construct_values(Person.objects.order_by('pk'), ['profile'])
+        with self.assertNumQueries(2):
+            profiles = DjangoValuesFactory(Profile).construct_values(Profile.objects.all(), ['person'])
+
+        self.assertEqual(people[0]['profile']['bio'], 'bio')
+        self.assertIsNone(people[1]['profile'])
+        self.assertEqual(profiles[0]['person']['first_name'], 'kirill')
+
+    def test_related_queries_are_skipped_without_rows(self):
+        with self.assertNumQueries(1):
+            rows = DjangoValuesFactory(Person).construct_values(Person.objects.filter(pk=0), ['articles'])
+
+        self.assertEqual(rows, [])
+
+
 class TestDjangoSorterFactory(TestCase):
     def setUp(self):
         self.factory = DjangoSorterFactory
@@ -165,6 +300,93 @@ class TestDjangoSorterFactory(TestCase):
     def test_can_something(self):
         pass
 
+    def test_can_parse_sort_orders(self):
+        """
+        Tests if parse_sort_orders keeps the order of a comma delimited list.
+
+            Given
+                A sort order: '-title:nulls_last,author.last_name'
+            When
+                I try to parse the sort orders
+            Then
+                I should get back: [('title', 'desc', 'nulls_last'), ('author.last_name', 'asc', None)]
+        """
+        instance = self.factory(Article.objects.all())
+        delimiter = instance.RELATION_DELIMITER
+
+        self.assertEqual(instance.parse_sort_orders('-title:nulls_last,author' + delimiter + 'last_name'), [
+            ('title', 'desc', 'nulls_last'),
+            ('author' + delimiter + 'last_name', 'asc', None),
+        ])
+
+    def test_can_construct_order_by_with_tiebreaker(self):
+        """
+        Tests if construct_order_by keeps the requested order and appends the primary key.
+
+            Given
+                A sort order: '-title,author.last_name'
+            When
+                I try to construct the order by
+            Then
+                I should get back: ['-title', 'author__last_name', 'pk']
+        """
+        instance = self.factory(Article.objects.all())
+        sort_orders = '-title,author' + instance.RELATION_DELIMITER + 'last_name'
+
+        self.assertEqual(instance.construct_order_by(sort_orders), ['-title', 'author__last_name', 'pk'])
+
+    def test_can_construct_order_by_from_dict(self):
+        instance = self.factory(Article.objects.all())
+
+        self.assertEqual(instance.construct_order_by({'title': 'desc'}), ['-title', 'pk'])
+
+    def test_construct_order_by_skips_invalid_fields_and_directions(self):
+        instance = self.factory(Article.objects.all())
+
+        self.assertEqual(instance.construct_order_by({'title': 'sideways', 'not_a_field': 'asc'}), [])
+        self.assertEqual(instance.construct_order_by('not_a_field,-title'), ['-title', 'pk'])
+
+    def test_construct_order_by_does_not_follow_to_many_relations(self):
+        instance = self.factory(Article.objects.all())
+
+        self.assertEqual(instance.construct_order_by('comments' + instance.RELATION_DELIMITER + 'text'), [])
+
+    def test_construct_order_by_skips_tiebreaker_when_unique(self):
+        instance = self.factory(Article.objects.all())
+
+        self.assertEqual(instance.construct_order_by('-id'), ['-id'])
+        self.assertEqual(instance.construct_order_by('title,pk'), ['title', 'id'])
+
+    def test_can_construct_order_by_with_nulls(self):
+        from django.db.models import F
+        instance = self.factory(Article.objects.all())
+
+        self.assertEqual(instance.construct_order_by('-title:nulls_last'), [F('title').desc(nulls_last=True), 'pk'])
+
+    def test_can_warn_when_not_indexed(self):
+        from magicbox.django.factories import UnindexedSortWarning
+        instance = self.factory(Article.objects.all(), index_policy='warn')
+
+        with self.assertWarns(UnindexedSortWarning):
+            instance.construct_order_by('title')
+
+    def test_shared_instance_sorts_given_query_set(self):
+        from django.db.models import Count
+        instance = self.factory.for_model(Article)
+        query_set = Article.objects.annotate(comment_count=Count('comments'))
+
+        self.assertIs(self.factory.for_model(Article), instance)
+        self.assertEqual(instance.construct_order_by('-comment_count', query_set), ['-comment_count', 'pk'])
+        self.assertEqual(instance.construct_order_by('-comment_count'), [])
+
+    def test_can_reject_when_not_indexed(self):
+        from magicbox.django.factories import UnindexedSortError
+        instance = self.factory(Article.objects.all(), index_policy='reject')
+
+        self.assertEqual(instance.construct_order_by('author,-title'), ['author', '-title', 'pk'])
+        with self.assertRaises(UnindexedSortError):
+            instance.construct_order_by('-title,author')
+
 
 class TestDjangoLimiterFactory(TestCase):
     def setUp(self):
@@ -181,6 +403,125 @@ class TestDjangoLimiterFactory(TestCase):
     def test_can_something(self):
         pass
 
+    def test_can_compile_flat_or_chain(self):
+        """
+        Tests if compile_filters flattens a chain of 'or' branches into a single node.
+
+            Given
+                Filters: {'title': '=a', 'or': {'title': '=b', 'or': {'title': '=c'}}}
+            When
+                I try to compile the filters
+            Then
+                I should get back a single OR node with three predicates
+        """
+        from django.db.models import Q
+        instance = self.factory(Article.objects.all())
+        q = instance.compile_filters({'title': '=a', 'or': {'title': '=b', 'or': {'title': '=c'}}})
+
+        self.assertEqual(q.connector, Q.OR)
+        self.assertEqual(q.children, [('title', 'a'), ('title', 'b'), ('title', 'c')])
+
+    def test_can_compile_and_and_or_branches(self):
+        """
+        Tests if compile_filters combines the branches with the predicates in the order they were given.
+
+            Given
+                Filters: {'title': '=a', 'and': {'blog': '=1'}, 'or': {'title': '=b'}}
+            When
+                I try to compile the filters
+            Then
+                I should get back: (title = a AND blog = 1) OR title = b
+        """
+        from django.db.models import Q
+        instance = self.factory(Article.objects.all())
+        q = instance.compile_filters({'title': '=a', 'and': {'blog': '=1'}, 'or': {'title': '=b'}})
+
+        self.assertEqual(q.connector, Q.OR)
+        self.assertEqual(q.children[1], ('title', 'b'))
+        self.assertEqual(q.children[0].connector, Q.AND)
+        self.assertEqual(q.children[0].children, [('title', 'a'), ('blog', '1')])
+
+    def test_can_compile_negated_predicates(self):
+        from django.db.models import Q
+        instance = self.factory(Article.objects.all())
+        q = instance.compile_filters({'title': '=a', 'or': {'title': '!=x', 'blog': '!=1'}})
+
+        self.assertEqual(q.connector, Q.OR)
+        self.assertEqual(q.children[0], ('title', 'a'))
+        self.assertTrue(q.children[1].negated)
+        self.assertEqual(q.children[1].children, [('title', 'x'), ('blog', '1')])
+
+    def test_compile_filters_merges_duplicate_predicates(self):
+        instance = self.factory(Article.objects.all())
+        q = instance.compile_filters({'title': '=a', 'or': {'title': '=a', 'or': {'title': '=a'}}})
+
+        self.assertEqual(q.children, [('title', 'a')])
+
+    def test_compile_filters_skips_invalid_filters(self):
+        instance = self.factory(Article.objects.all())
+
+        self.assertIsNone(instance.compile_filters({'not_a_field': '=1', 'or': {'title': '?x'}}))
+
+    def test_can_determine_longest_token(self):
+        """
+        Tests if determine_limiter prefers two character tokens over their first character.
+
+            Given
+                A limiter: '>=5'
+            When
+                I try to determine the limiter
+            Then
+                I should get back: 'filter', '__gte', '5'
+        """
+        instance = self.factory.for_model(Article)
+
+        self.assertEqual(instance.determine_limiter('>=5'), ('filter', '__gte', '5'))
+        self.assertEqual(instance.determine_limiter('<=5'), ('filter', '__lte', '5'))
+        self.assertEqual(instance.determine_limiter('>5'), ('filter', '__gt', '5'))
+        self.assertEqual(instance.determine_limiter('!~a'), ('exclude', '__contains', 'a'))
+        self.assertIsNone(instance.determine_limiter('?a'))
+
+    def test_shared_instance_limits_given_query_set(self):
+        instance = self.factory.for_model(Article)
+        query_set = instance.construct_query_set({'title': '=a'}, Article.objects.all())
+
+        self.assertIs(self.factory.for_model(Article), instance)
+        self.assertEqual(query_set.query.where.children[0].rhs, 'a')
+
+    def test_and_binds_tighter_than_or_in_nested_branches(self):
+        """
+        Tests if nested branches keep the grouping of the filter tree read as one expression.
+
+            Given
+                A filter tree: {'title': '=a', 'and': {'title': '=b', 'or': {'author': '=1'}}}
+            When
+                I compile the filters
+            Then
+                I should get back: (title = a AND title = b) OR author = 1
+        """
+        from django.db.models import Q
+        instance = self.factory(Article.objects.all())
+        q = instance.compile_filters({'title': '=a', 'and': {'title': '=b', 'or': {'author': '=1'}}})
+
+        self.assertEqual(q.connector, Q.OR)
+        self.assertEqual(q.children[0].connector, Q.AND)
+        self.assertEqual(q.children[0].children, [('title', 'a'), ('title', 'b')])
+        self.assertEqual(q.children[1], ('author', '1'))
+
+        q = instance.compile_filters({'title': '=a', 'or': {'title': '=b', 'and': {'author': '=1'}}})
+
+        self.assertEqual(q.connector, Q.OR)
+        self.assertEqual(q.children[0], ('title', 'a'))
+        self.assertEqual(q.children[1].connector, Q.AND)
+        self.assertEqual(q.children[1].children, [('title', 'b'), ('author', '1')])
+
+    def test_compile_filters_does_not_modify_filters(self):
+        instance = self.factory(Article.objects.all())
+        filters = {'title': '=a', 'and': {'blog': '=1', 'or': {'title': '=b'}}}
+        instance.compile_filters(filters)
+
+        self.assertEqual(filters, {'title': '=a', 'and': {'blog': '=1', 'or': {'title': '=b'}}})
+
 
 class TestDjangoAggregatorFactory(TestCase):
     def setUp(self):
@@ -0,0 +1,122 @@
+from io import BytesIO
+
+from django.test import RequestFactory
+from magicbox.django import parsers
+from tests.django import MagicBoxTestCase as TestCase
+
+
+def stream(body, chunk_size=4, max_size=None):
+    return parsers.LimitedStream(BytesIO(body), max_size=max_size, chunk_size=chunk_size)
+
+
+class TestParseBody(TestCase):
+    def setUp(self):
+        self.request_factory = RequestFactory()
+
+    def test_can_parse_json_object(self):
+        request = self.request_factory.post('/', b'{"name": "kirill"}', content_type='application/json')
+
+        self.assertEqual(parsers.parse_body(request), {'name': 'kirill'})
+
+    def test_can_parse_form(self):
+        request = self.request_factory.post(
+            '/', b'name=kirill&blog[name]=fuzz', content_type='application/x-www-form-urlencoded'
+        )
+
+        self.assertEqual(parsers.parse_body(request), {'name': 'kirill', 'blog': {'name': 'fuzz'}})
+
+    def test_can_parse_content_type(self):
+        self.assertEqual(
+            parsers.parse_content_type('Application/JSON; charset="latin-1"'),
+            ('application/json', {'charset': 'latin-1'})
+        )
+
+    def test_empty_body_is_none(self):
+        request = self.request_factory.post('/', b'', content_type='application/json')
+
+        self.assertIsNone(parsers.parse_body(request))
+
+    def test_rejects_unsupported_media_type(self):
+        request = self.request_factory.post('/', b'<name>kirill</name>', content_type='application/xml')
+
+        with self.assertRaises(parsers.UnsupportedMediaType):
+            parsers.parse_body(request)
+
+    def test_rejects_body_over_max_size(self):
+        request = self.request_factory.post('/', b'{"name": "kirill"}', content_type='application/json')
+
+        with self.assertRaises(parsers.RequestEntityTooLarge):
+            parsers.parse_body(request, max_size=8)
+
+    def test_rejects_stream_over_max_size(self):
+        items = parsers.parse_ndjson(stream(b'{"a": 1}\n{"a": 2}\n{"a": 3}\n', max_size=12), 'utf-8')
+
+        with self.assertRaises(parsers.RequestEntityTooLarge):
+            list(items)
+
+    def test_reads_array_into_list_unless_streamed(self):
+        body = b'[{"name": "kirill"}, {"name": "fuzz"}]'
+
+        items = parsers.parse_body(self.request_factory.post('/', body, content_type='application/json'))
+        self.assertEqual(items, [{'name': 'kirill'}, {'name': 'fuzz'}])
+
+        items = parsers.parse_body(self.request_factory.post('/', body, content_type='application/json'), stream=True)
+        self.assertNotIsInstance(items, list)
+        self.assertEqual(list(items), [{'name': 'kirill'}, {'name': 'fuzz'}])
+
+    def test_rejects_invalid_json(self):
+        with self.assertRaises(parsers.ParseError):
+            parsers.parse_json(stream(b'{"name": '), 'utf-8')
+
+
+class TestStreamedJson(TestCase):
+    def test_can_stream_json_array(self):
+        """
+        Tests if a top level JSON array is parsed item by item across chunk boundaries.
+        """
+        body = b' [{"name": "kirill", "tags": ["a", "]"]}, 123, "x,y", null , {"n": 1.5}] '
+        items = parsers.parse_json(stream(body, chunk_size=3), 'utf-8')
+
+        self.assertNotIsInstance(items, list)
+        self.assertEqual(list(items), [{'name': 'kirill', 'tags': ['a', ']']}, 123, 'x,y', None, {'n': 1.5}])
+
+    def test_does_not_split_numbers_across_chunks(self):
+        items = parsers.parse_json(stream(b'[12345,678]', chunk_size=2), 'utf-8')
+
+        self.assertEqual(list(items), [12345, 678])
+
+    def test_can_stream_item_spanning_many_chunks(self):
+        text = 'x' * 10000
+        items = parsers.parse_json(stream(('[{"text": "%s"}, 1]' % text).encode('utf-8'), chunk_size=7), 'utf-8')
+
+        self.assertEqual(list(items), [{'text': text}, 1])
+
+    def test_can_stream_empty_array(self):
+        self.assertEqual(list(parsers.parse_json(stream(b'[ ]'), 'utf-8')), [])
+
+    def test_can_stream_multi_byte_characters(self):
+        items = parsers.parse_json(stream('["ü", "日本"]'.encode('utf-8'), chunk_size=1), 'utf-8')
+
+        self.assertEqual(list(items), ['ü', '日本'])
+
+    def test_rejects_unterminated_array(self):
+        with self.assertRaises(parsers.ParseError):
+            list(parsers.parse_json(stream(b'[1, 2'), 'utf-8'))
+
+    def test_rejects_missing_comma(self):
+        with self.assertRaises(parsers.ParseError):
+            list(parsers.parse_json(stream(b'[1 2]'), 'utf-8'))
+
+    def test_can_stream_ndjson(self):
+        items = parsers.parse_ndjson(stream(b'{"a": 1}\n\n{"a": 2}\r\n{"a": 3}', chunk_size=5), 'utf-8')
+
+        self.assertEqual(list(items), [{'a': 1}, {'a': 2}, {'a': 3}])
+
+    def test_can_stream_ndjson_line_spanning_many_chunks(self):
+        items = parsers.parse_ndjson(stream(b'{"a": "' + b'x' * 50 + b'"}\n{"a": 1}\n', chunk_size=3), 'utf-8')
+
+        self.assertEqual(list(items), [{'a': 'x' * 50}, {'a': 1}])
+
+    def test_rejects_ndjson_with_unknown_charset(self):
+        with self.assertRaises(parsers.UnsupportedMediaType):
+            parsers.parse_ndjson(stream(b'{"a": 1}\n'), 'unknown')
@@ -1 +1,301 @@
-from tests.django import MagicBoxTestCase as TestCase
\ No newline at end of file
+import datetime
+
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from magicbox.django import rollups
+from magicbox.django.repository import EMPTY_SPEC, DjangoRepository, RequestSpec, build_etag, etag_matches, get_last_modified, \
+    resource
+from tests.django import MagicBoxDatabaseTestCase, MagicBoxTestCase as TestCase
+from tests.django.fixtures.models import Article, Blog, Comment, Person
+
+
+class TestConditionalHelpers(TestCase):
+    def setUp(self):
+        self.request_factory = RequestFactory()
+
+    def test_etag_depends_on_fingerprint(self):
+        request = self.request_factory.get('/articles/', {'include': 'comments'})
+        etag = build_etag(request, [(1, 2)])
+
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(etag, build_etag(request, [(1, 2)]))
+        self.assertNotEqual(etag, build_etag(request, [(1, 3)]))
+
+    def test_etag_depends_on_query_string(self):
+        request = self.request_factory.get('/articles/', {'include': 'comments'})
+        other_request = self.request_factory.get('/articles/', {'sort': '-title'})
+
+        self.assertNotEqual(build_etag(request, [(1, 2)]), build_etag(other_request, [(1, 2)]))
+
+    def test_etag_matches_if_none_match(self):
+        etag = 'W/"abc"'
+
+        self.assertTrue(etag_matches(etag, 'W/"abc"'))
+        self.assertTrue(etag_matches(etag, '"xyz", "abc"'))
+        self.assertTrue(etag_matches(etag, '*'))
+        self.assertFalse(etag_matches(etag, '"xyz"'))
+        self.assertFalse(etag_matches(etag, ''))
+
+    def test_last_modified_uses_newest_datetime(self):
+        fingerprint = [
+            (datetime.datetime(2016, 8, 1, 12, 0, 0), 10),
+            (datetime.datetime(2016, 8, 2, 12, 0, 0), 3),
+            (42, 7),
+        ]
+
+        self.assertEqual(get_last_modified(fingerprint), 'Tue, 02 Aug 2016 12:00:00 GMT')
+        self.assertIsNone(get_last_modified([(42, 7)]))
+
+
+class TestConditionalResource(MagicBoxDatabaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        blog = Blog.objects.create(name='blog')
+        author = Person.objects.create(first_name='kirill', last_name='f', blog=blog)
+        cls.article = Article.objects.create(title='first', author=author, blog=blog)
+        cls.comment = Comment.objects.create(text='one', article=cls.article)
+
+    def setUp(self):
+        self.request_factory = RequestFactory()
+        self.calls = []
+
+        @resource(Article, conditional=True)
+        def view(request, repository):
+            self.calls.append(request)
+            return HttpResponse(repository.dumps(), content_type='application/json')
+
+        self.view = view
+
+    def test_can_answer_not_modified_until_rows_change(self):
+        """
+        Tests if a repeated GET with the ETag of the first response is answered with a 304 until a row changes.
+        """
+        response = self.view(self.request_factory.get('/articles/'))
+        etag = response['ETag']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.view(self.request_factory.get('/articles/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(self.calls), 1)
+
+        Article.objects.filter(pk=self.article.pk).update(updated_at=self.article.updated_at + datetime.timedelta(days=1))
+
+        response = self.view(self.request_factory.get('/articles/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_views_are_not_conditional_by_default(self):
+        @resource(Article)
+        def view(request, repository):
+            return HttpResponse(repository.dumps(), content_type='application/json')
+
+        etag = self.view(self.request_factory.get('/articles/'))['ETag']
+
+        with self.assertNumQueries(1):
+            response = view(self.request_factory.get('/articles/', HTTP_IF_NONE_MATCH=etag))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_includes_without_version_field_are_not_conditional(self):
+        response = self.view(self.request_factory.get('/articles/', {'include': 'comments'}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    @override_settings(MAGIC_BOX_SORT_INDEX_POLICY='reject')
+    def test_unindexed_sort_is_a_bad_request_before_fingerprinting(self):
+        response = self.view(self.request_factory.get('/articles/', {'sort': 'title'}))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.calls, [])
+
+    @override_settings(MAGIC_BOX_ETAG_PK_FALLBACK=True)
+    def test_can_opt_in_to_primary_key_fallback(self):
+        response = self.view(self.request_factory.get('/articles/', {'include': 'comments'}))
+
+        self.assertTrue(response.has_header('ETag'))
+        self.assertEqual(len(DjangoRepository(Article).set_includes('comments').fingerprint('updated_at')), 2)
+
+
+class TestWriteResource(MagicBoxDatabaseTestCase):
+    def setUp(self):
+        self.request_factory = RequestFactory()
+
+        @resource(Blog, stream_body=True)
+        def create_view(request, repository):
+            return HttpResponse(str(repository.create_many(batch_size=2)), status=201)
+
+        @resource(Blog)
+        def count_view(request, repository):
+            return HttpResponse(str(len(repository.input)))
+
+        self.create_view = create_view
+        self.count_view = count_view
+
+    def post(self, view, body, content_type='application/json'):
+        return view(self.request_factory.post('/blogs/', body, content_type=content_type))
+
+    def test_can_create_many_from_streamed_array(self):
+        # Two batched inserts inside the transaction's savepoint.
+        with self.assertNumQueries(4):
+            response = self.post(self.create_view, b'[{"name": "a"}, {"name": "b"}, {"name": "c"}]')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.content, b'3')
+        self.assertEqual(sorted(Blog.objects.values_list('name', flat=True)), ['a', 'b', 'c'])
+
+    def test_can_create_many_from_ndjson(self):
+        response = self.post(self.create_view, b'{"name": "a"}\n{"name": "b"}\n', 'application/x-ndjson')
+
+        self.assertEqual(response.content, b'2')
+        self.assertEqual(Blog.objects.count(), 2)
+
+    def test_invalid_item_creates_nothing(self):
+        response = self.post(self.create_view, b'[{"name": "a"}, {"name": "b"}, {"name": "c"}, 4]')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Blog.objects.count(), 0)
+
+    def test_invalid_streamed_json_is_a_bad_request(self):
+        response = self.post(self.create_view, b'[{"name": "a"}, {"name": "b"}, {"name": ]')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Blog.objects.count(), 0)
+
+    def test_array_input_is_a_list_without_streaming(self):
+        response = self.post(self.count_view, b'[{"name": "a"}, {"name": "b"}]')
+
+        self.assertEqual(response.content, b'2')
+
+    def test_invalid_json_is_a_bad_request(self):
+        response = self.post(self.count_view, b'[{"name": ]')
+
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(MAGIC_BOX_MAX_BODY_SIZE=8)
+    def test_large_body_is_rejected(self):
+        response = self.post(self.create_view, b'[{"name": "a"}]')
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(Blog.objects.count(), 0)
+
+    def test_unsupported_media_type_is_rejected(self):
+        response = self.post(self.create_view, b'<name>a</name>', 'application/xml')
+
+        self.assertEqual(response.status_code, 415)
+
+
+class TestSortRejection(TestCase):
+    @override_settings(MAGIC_BOX_SORT_INDEX_POLICY='reject')
+    def test_unindexed_sort_is_a_bad_request(self):
+        @resource(Person)
+        def view(request, repository):
+            repository.query()
+            return HttpResponse('ok')
+
+        request_factory = RequestFactory()
+
+        response = view(request_factory.get('/people/', {'sort': 'first_name'}))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'first_name', response.content)
+
+        self.assertEqual(view(request_factory.get('/people/', {'sort': '-id'})).status_code, 200)
+
+
+class TestGroupedRepository(MagicBoxDatabaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.blog = Blog.objects.create(name='first')
+        cls.other_blog = Blog.objects.create(name='second')
+        author = Person.objects.create(first_name='kirill', last_name='ryabinin', blog=cls.blog)
+        Article.objects.bulk_create(
+            [Article(title='article', author=author, blog=cls.blog) for _ in range(2)] +
+            [Article(title='article', author=author, blog=cls.other_blog)]
+        )
+
+    def get_repository(self, sort_order=None):
+        return DjangoRepository(Article).set_group_by('blog').set_aggregate({'count': 'id'}).set_sort_order(sort_order)
+
+    def test_sorted_groups_are_not_split_by_primary_key(self):
+        rows = self.get_repository('-id__count').all()
+
+        self.assertEqual(rows, [
+            {'blog': self.blog.pk, 'id__count': 2},
+            {'blog': self.other_blog.pk, 'id__count': 1},
+        ])
+
+    def test_groups_can_only_be_sorted_by_their_columns(self):
+        rows = self.get_repository('-id,blog').all()
+
+        self.assertEqual([row['blog'] for row in rows], [self.blog.pk, self.other_blog.pk])
+
+    def test_values_returns_groups(self):
+        repository = self.get_repository('blog').set_includes('comments')
+
+        self.assertEqual(repository.values(), [
+            {'blog': self.blog.pk, 'id__count': 2},
+            {'blog': self.other_blog.pk, 'id__count': 1},
+        ])
+
+    def test_rollup_and_database_return_the_same_rows(self):
+        expected = self.get_repository().all()
+        rollup = rollups.register(Article, dimensions=['blog'], aggregations=[('count', 'id')])
+        self.addCleanup(rollups.unregister, Article)
+        rollup.rebuild()
+
+        with self.assertNumQueries(1):
+            rows = self.get_repository().all()
+
+        self.assertIsInstance(expected, list)
+        self.assertEqual(sorted(rows, key=lambda row: row['blog']), sorted(expected, key=lambda row: row['blog']))
+
+    def test_unbuilt_rollup_falls_back_to_database(self):
+        expected = self.get_repository().all()
+        rollups.register(Article, dimensions=['blog'], aggregations=[('count', 'id')])
+        self.addCleanup(rollups.unregister, Article)
+
+        self.assertEqual(self.get_repository().all(), expected)
+
+
+class TestRequestSpec(TestCase):
+    def test_can_build_from_params(self):
+        spec = RequestSpec.from_params({'filters': {'blog': '=1'}, 'include': 'articles', 'group': 'blog, author'})
+
+        self.assertEqual(spec.filters, {'blog': '=1'})
+        self.assertEqual(spec.includes, ['articles'])
+        self.assertEqual(spec.group_by, ('blog', 'author'))
+        self.assertIsNone(spec.sort_order)
+
+    def test_setters_replace_spec(self):
+        repository = DjangoRepository(Person)
+        spec = repository.spec
+
+        self.assertIs(repository.set_filters({'first_name': '=kirill'}).set_group_by('blog'), repository)
+        self.assertEqual(repository.filters, {'first_name': '=kirill'})
+        self.assertEqual(repository.spec.group_by, ('blog',))
+        self.assertEqual(spec.filters, {})
+        self.assertEqual(DjangoRepository(Person).filters, {})
+
+    def test_empty_spec_values_are_not_shared(self):
+        repository = DjangoRepository(Article)
+        repository.input['title'] = 'changed'
+        repository.filters['title'] = '=changed'
+        repository.includes.append('comments')
+
+        self.assertEqual(repository.input, {'title': 'changed'})
+        self.assertEqual(repository.spec.filters, {'title': '=changed'})
+        self.assertEqual(repository.includes, ['comments'])
+        self.assertEqual(DjangoRepository(Person).input, {})
+        self.assertEqual(DjangoRepository(Person).filters, {})
+        self.assertEqual(DjangoRepository(Person).includes, [])
+        self.assertEqual(EMPTY_SPEC, RequestSpec({}, [], {}, {}, (), {}))
+
+    def test_repository_accepts_other_attributes(self):
+        repository = DjangoRepository(Article)
+        repository.request = 'request'
+
+        self.assertEqual(repository.request, 'request')
@@ -0,0 +1,283 @@
+import datetime
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from magicbox.django import rollups
+from magicbox.django.models import AggregateRollup
+from magicbox.django.parsers import ParseError
+from magicbox.django.repository import DjangoRepository
+from tests.django import MagicBoxDatabaseTestCase, MagicBoxTestCase as TestCase
+from tests.django.fixtures.models import Article, Blog, Comment, Person
+
+
+class TestRollup(TestCase):
+    def setUp(self):
+        self.rollup = rollups.Rollup(Article, dimensions=['blog', 'author'], aggregations=[('count', 'id')])
+
+    def test_can_name_rollup(self):
+        self.assertEqual(self.rollup.name, 'django.article:blog,author')
+        self.assertEqual(rollups.Rollup(Article, ['blog'], [('count', 'id')], name='per_blog').name, 'per_blog')
+
+    def test_can_match_grouped_aggregation(self):
+        """
+        Tests if a rollup matches an aggregation grouped by the same fields in any order.
+        """
+        self.assertTrue(self.rollup.matches(['author', 'blog'], 'count', 'id'))
+        self.assertFalse(self.rollup.matches(['blog'], 'count', 'id'))
+        self.assertFalse(self.rollup.matches(['blog', 'author'], 'sum', 'id'))
+
+    def test_can_parse_exact_filters_on_dimensions(self):
+        self.assertEqual(self.rollup.parse_filters(None), {})
+        self.assertEqual(self.rollup.parse_filters({'blog': '=2'}), {'blog': 2})
+
+    def test_can_not_parse_other_filters(self):
+        self.assertIsNone(self.rollup.parse_filters({'title': '=kirill'}))
+        self.assertIsNone(self.rollup.parse_filters({'blog': '!=2'}))
+        self.assertIsNone(self.rollup.parse_filters({'blog': '^2'}))
+        self.assertIsNone(self.rollup.parse_filters({'or': {'blog': '=2'}}))
+
+    def test_can_get_dimension_values(self):
+        article = Article(blog_id=3, author_id=5)
+
+        self.assertEqual(self.rollup.get_dimension_values(article), (3, 5))
+
+
+class TestRollupRegistry(TestCase):
+    def tearDown(self):
+        rollups.unregister(Comment)
+
+    def test_can_register_and_find(self):
+        rollup = rollups.register(Comment, dimensions=['article'], aggregations=[('count', 'id')])
+
+        self.assertIs(rollups.find(Comment, ['article'], 'count', 'id'), rollup)
+        self.assertIsNone(rollups.find(Comment, ['article'], 'max', 'id'))
+        self.assertEqual(rollups.get_rollups(Comment), [rollup])
+
+    def test_register_replaces_rollup_with_same_name(self):
+        rollups.register(Comment, dimensions=['article'], aggregations=[('count', 'id')])
+        rollup = rollups.register(Comment, dimensions=['article'], aggregations=[('max', 'id')])
+
+        self.assertEqual(rollups.get_rollups(Comment), [rollup])
+
+    def test_can_unregister(self):
+        rollups.register(Comment, dimensions=['article'], aggregations=[('count', 'id')])
+        rollups.unregister(Comment)
+
+        self.assertEqual(rollups.get_rollups(Comment), [])
+        self.assertIsNone(rollups.find(Comment, ['article'], 'count', 'id'))
+
+
+class TestRollupMaintenance(MagicBoxDatabaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.blog = Blog.objects.create(name='first')
+        cls.other_blog = Blog.objects.create(name='second')
+        cls.author = Person.objects.create(first_name='kirill', last_name='ryabinin', blog=cls.blog)
+
+    def setUp(self):
+        self.rollup = rollups.register(Article, dimensions=['blog'], aggregations=[
+            ('count', 'id'), ('sum', 'id'), ('avg', 'id'), ('min', 'id'), ('max', 'updated_at'),
+        ])
+        self.rollup.rebuild()
+
+    def tearDown(self):
+        rollups.unregister(Article)
+
+    def create_article(self, blog=None):
+        return Article.objects.create(title='article', author=self.author, blog=blog or self.blog)
+
+    def assertMatchesDatabase(self):
+        """
+        Asserts every aggregation of the rollup reads the same rows, with the same types, as the database.
+        """
+        aggregations = self.rollup.build_aggregations()
+
+        for operation, field in self.rollup.aggregations:
+            alias = self.rollup.get_alias(operation, field)
+            expected = list(Article.objects.order_by('blog').values('blog').annotate(**{alias: aggregations[alias]}))
+            rows = sorted(self.rollup.read(operation, field), key=lambda row: row['blog'])
+
+            self.assertEqual(rows, expected)
+            for row, expected_row in zip(rows, expected):
+                self.assertIs(type(row[alias]), type(expected_row[alias]))
+
+    def test_created_rows_are_added_to_their_groups(self):
+        self.create_article()
+        self.create_article()
+        self.create_article(self.other_blog)
+
+        self.assertMatchesDatabase()
+
+    def test_created_row_does_not_read_its_group(self):
+        self.create_article()
+
+        with CaptureQueriesContext(connection) as context:
+            self.create_article()
+
+        self.assertFalse([query for query in context.captured_queries if 'FROM "django_article"' in query['sql']])
+        self.assertMatchesDatabase()
+
+    def test_missing_group_is_computed_from_base_table(self):
+        # bulk_create sends no signals, the group is computed when the next saved row reaches it.
+        Article.objects.bulk_create([Article(title='bulk', author=self.author, blog=self.blog) for _ in range(2)])
+        self.create_article()
+
+        self.assertEqual(self.rollup.read('count', 'id'), [{'blog': self.blog.pk, 'id__count': 3}])
+        self.assertMatchesDatabase()
+
+    def test_moved_row_updates_both_groups(self):
+        article = self.create_article()
+        self.create_article()
+        self.create_article(self.other_blog)
+
+        article.blog = self.other_blog
+        article.save()
+
+        self.assertMatchesDatabase()
+
+    def test_removed_extreme_is_recomputed(self):
+        first = self.create_article()
+        self.create_article()
+        last = self.create_article()
+
+        first.delete()
+        last.delete()
+
+        self.assertMatchesDatabase()
+
+    def test_removing_last_row_removes_group(self):
+        article = self.create_article(self.other_blog)
+        self.create_article()
+
+        article.delete()
+
+        self.assertEqual([row['blog'] for row in self.rollup.read('count', 'id')], [self.blog.pk])
+        self.assertMatchesDatabase()
+
+    def test_deferred_changes_are_applied_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with rollups.deferred():
+                first = self.create_article()
+                self.create_article()
+                self.create_article(self.other_blog)
+                first.delete()
+
+            self.assertFalse(AggregateRollup.objects.filter(rollup=self.rollup.name).exclude(key=rollups.BUILT).exists())
+
+        self.assertMatchesDatabase()
+
+    def test_failed_deferred_block_does_not_change_rollup(self):
+        self.create_article()
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(ValueError):
+            with rollups.deferred():
+                self.create_article()
+                raise ValueError('failed')
+
+        self.assertEqual(self.rollup.read('count', 'id'), [{'blog': self.blog.pk, 'id__count': 1}])
+
+    def test_failed_create_many_does_not_change_rollup(self):
+        self.create_article()
+
+        def items():
+            for _ in range(3):
+                yield {'title': 'streamed', 'author_id': self.author.pk, 'blog_id': self.blog.pk}
+            raise ParseError('Invalid JSON.')
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(ParseError):
+            DjangoRepository(Article).set_input(items()).create_many(batch_size=2)
+
+        self.assertEqual(Article.objects.count(), 1)
+        self.assertEqual(self.rollup.read('count', 'id'), [{'blog': self.blog.pk, 'id__count': 1}])
+
+    def test_rebuild_recomputes_every_group(self):
+        self.create_article()
+        self.create_article(self.other_blog)
+        AggregateRollup.objects.filter(rollup=self.rollup.name).delete()
+
+        self.assertIsNone(self.rollup.read('count', 'id'))
+        self.assertEqual(self.rollup.rebuild(), 2)
+        self.assertMatchesDatabase()
+
+    def test_read_does_not_answer_before_rebuild(self):
+        rollup = rollups.register(Article, dimensions=['author'], aggregations=[('count', 'id')])
+        self.create_article()
+
+        self.assertIsNone(rollup.read('count', 'id'))
+        self.assertIsNone(rollup.read('count', 'id', {'author': '=%d' % self.author.pk}))
+
+        rollup.rebuild()
+
+        self.assertEqual(rollup.read('count', 'id'), [{'author': self.author.pk, 'id__count': 1}])
+
+    def test_read_does_not_answer_after_definition_changed(self):
+        self.create_article()
+        rollup = rollups.register(Article, dimensions=['blog'], aggregations=[('count', 'id'), ('max', 'id')])
+
+        self.assertEqual(rollup.name, self.rollup.name)
+        self.assertIsNone(rollup.read('count', 'id'))
+
+        rollup.rebuild()
+
+        self.assertEqual(rollup.read('count', 'id'), [{'blog': self.blog.pk, 'id__count': 1}])
+
+    def test_read_looks_up_filtered_group_by_key(self):
+        self.create_article()
+        self.create_article(self.other_blog)
+
+        rows = self.rollup.read('count', 'id', {'blog': '=%d' % self.other_blog.pk})
+
+        self.assertEqual(rows, [{'blog': self.other_blog.pk, 'id__count': 1}])
+
+    def test_read_does_not_answer_filters_on_some_dimensions(self):
+        rollup = rollups.register(Article, dimensions=['blog', 'author'], aggregations=[('count', 'id')])
+        rollup.rebuild()
+        self.create_article()
+
+        self.assertIsNone(rollup.read('count', 'id', {'blog': '=%d' % self.blog.pk}))
+        self.assertEqual(len(rollup.read('count', 'id', {'blog': '=%d' % self.blog.pk, 'author': '=%d' % self.author.pk})), 1)
+
+    def test_read_orders_columns_by_group_by(self):
+        rollup = rollups.register(Article, dimensions=['blog', 'author'], aggregations=[('count', 'id')])
+        rollup.rebuild()
+        self.create_article()
+
+        self.assertEqual(list(rollup.read('count', 'id', group_by=['author', 'blog'])[0]), ['author', 'blog', 'id__count'])
+
+    def test_read_can_filter_datetime_dimension(self):
+        rollup = rollups.register(Article, dimensions=['updated_at'], aggregations=[('count', 'id')])
+        rollup.rebuild()
+        article = self.create_article()
+        self.create_article()
+
+        rows = rollup.read('count', 'id', {'updated_at': '=' + article.updated_at.isoformat()})
+
+        self.assertEqual(rows, [{'updated_at': article.updated_at, 'id__count': 1}])
+        self.assertIsInstance(rows[0]['updated_at'], datetime.datetime)
+
+
+class TestRebuildRollupsCommand(MagicBoxDatabaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        blog = Blog.objects.create(name='first')
+        author = Person.objects.create(first_name='kirill', last_name='ryabinin', blog=blog)
+        Article.objects.bulk_create([Article(title='article', author=author, blog=blog) for _ in range(3)])
+
+    def setUp(self):
+        self.rollup = rollups.register(Article, dimensions=['blog'], aggregations=[('count', 'id')])
+
+    def tearDown(self):
+        rollups.unregister(Article)
+
+    def test_can_rebuild_rollups(self):
+        stdout = StringIO()
+        call_command('magicbox_rebuild_rollups', stdout=stdout)
+
+        self.assertIn('Rebuilt django.article:blog (1 groups)', stdout.getvalue())
+        self.assertEqual(self.rollup.read('count', 'id')[0]['id__count'], 3)
+
+    def test_unknown_rollup_is_an_error(self):
+        with self.assertRaises(CommandError):
+            call_command('magicbox_rebuild_rollups', 'unknown', stdout=StringIO())
@@ -0,0 +1,187 @@
+import json
+
+from magicbox.django import snapshots
+from magicbox.django.factories import DjangoValuesFactory
+from magicbox.django.models import IncludeSnapshot
+from magicbox.django.repository import DjangoRepository
+from magicbox.utils import json_dumps
+from tests.django import MagicBoxDatabaseTestCase, MagicBoxTestCase as TestCase
+from tests.django.fixtures.models import Article, Blog, Comment, Person
+
+
+class TestSnapshot(TestCase):
+    def setUp(self):
+        self.snapshot = snapshots.Snapshot(Person, includes=['articles.comments', 'blog'])
+
+    def test_can_name_snapshot(self):
+        self.assertEqual(self.snapshot.name, 'django.person:articles.comments,blog')
+        self.assertEqual(snapshots.Snapshot(Person, ['blog'], name='person_blog').name, 'person_blog')
+
+    def test_can_match_includes(self):
+        """
+        Tests if a snapshot matches the same include tree in any order, ignoring invalid relations.
+        """
+        self.assertTrue(self.snapshot.matches(['blog', 'articles.comments']))
+        self.assertTrue(self.snapshot.matches(['blog', 'articles.comments', 'articles', 'fake']))
+        self.assertFalse(self.snapshot.matches(['articles.comments']))
+        self.assertFalse(self.snapshot.matches([]))
+
+    def test_can_get_dependencies(self):
+        self.assertEqual(self.snapshot.get_dependencies(), [
+            (Person, 'pk'),
+            (Article, 'articles__pk'),
+            (Comment, 'articles__comments__pk'),
+            (Blog, 'blog__pk'),
+        ])
+
+    def test_root_rows_are_their_own_roots(self):
+        self.assertEqual(self.snapshot.find_roots('pk', [1, 2]), {1, 2})
+
+    def test_can_serialize_includes(self):
+        row = {'id': 1, 'first_name': 'kirill', 'blog_id': 2, 'blog': {'id': 2, 'name': 'blog'}, 'articles': []}
+
+        self.assertEqual(self.snapshot.serialize(row), '{"articles":[],"blog":{"id":2,"name":"blog"}}')
+
+    def test_can_load_annotated_instance(self):
+        person = Person()
+        self.assertIsNone(snapshots.load(person))
+
+        setattr(person, snapshots.ANNOTATION, '{"articles":[]}')
+        self.assertEqual(snapshots.load(person), {'articles': []})
+
+
+class TestSnapshotRegistry(TestCase):
+    def tearDown(self):
+        snapshots.unregister(Article)
+
+    def test_can_register_and_find(self):
+        snapshot = snapshots.register(Article, includes=['comments'])
+
+        self.assertIs(snapshots.find(Article, ['comments']), snapshot)
+        self.assertIsNone(snapshots.find(Article, ['author']))
+        self.assertEqual(snapshots.get_snapshots(Article), [snapshot])
+
+    def test_can_unregister(self):
+        snapshots.register(Article, includes=['comments'])
+        snapshots.unregister(Article)
+
+        self.assertEqual(snapshots.get_snapshots(Article), [])
+        self.assertEqual(snapshots.find_roots(Comment, [1]), [])
+
+
+class TestSnapshotDatabase(MagicBoxDatabaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        blog = Blog.objects.create(name='blog')
+        cls.person = Person.objects.create(first_name='kirill', last_name='fuchs', blog=blog)
+        cls.other_person = Person.objects.create(first_name='other', last_name='person', blog=blog)
+        cls.article = Article.objects.create(title='first', author=cls.person, blog=blog)
+        Article.objects.create(title='second', author=cls.other_person, blog=blog)
+        cls.comment = Comment.objects.create(text='hello', article=cls.article)
+
+    def setUp(self):
+        self.snapshot = snapshots.register(Person, includes=['articles.comments'])
+
+    def tearDown(self):
+        snapshots.unregister(Person)
+
+    def get_repository(self):
+        return DjangoRepository(Person).set_includes('articles.comments').set_sort_order('id')
+
+    def get_relation_values(self):
+        rows = DjangoValuesFactory.for_model(Person).construct_values(Person.objects.order_by('id'), ['articles.comments'])
+        return json.loads(json_dumps(rows))
+
+    def get_data(self, person):
+        return json.loads(IncludeSnapshot.objects.get(snapshot=self.snapshot.name, key=str(person.pk)).data)
+
+    def test_values_read_includes_from_snapshot(self):
+        self.assertEqual(self.snapshot.rebuild(), 2)
+
+        with self.assertNumQueries(1):
+            rows = self.get_repository().dumps()
+
+        self.assertEqual(json.loads(rows), self.get_relation_values())
+
+    def test_rows_without_snapshot_read_includes_from_relations(self):
+        self.snapshot.refresh_many([self.person.pk])
+
+        self.assertEqual(json.loads(self.get_repository().dumps()), self.get_relation_values())
+
+    def test_query_keeps_prefetching_includes(self):
+        self.snapshot.rebuild()
+
+        with self.assertNumQueries(3):
+            people = list(self.get_repository().query())
+            comments = [comment.text for person in people for article in person.articles.all() for comment in article.comments.all()]
+
+        self.assertEqual(comments, ['hello'])
+        self.assertFalse(hasattr(people[0], snapshots.ANNOTATION))
+
+    def test_saved_rows_refresh_their_roots(self):
+        self.snapshot.rebuild()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(text='new', article=self.article)
+        self.assertEqual([comment['text'] for comment in self.get_data(self.person)['articles'][0]['comments']], ['hello', 'new'])
+
+        self.article.author = self.other_person
+        with self.captureOnCommitCallbacks(execute=True):
+            self.article.save()
+        self.assertEqual(self.get_data(self.person)['articles'], [])
+        self.assertEqual(len(self.get_data(self.other_person)['articles']), 2)
+
+    def test_deleted_rows_refresh_their_roots(self):
+        self.snapshot.rebuild()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comment.delete()
+        self.assertEqual(self.get_data(self.person)['articles'][0]['comments'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.person.delete()
+        self.assertFalse(IncludeSnapshot.objects.filter(snapshot=self.snapshot.name, key=str(self.person.pk)).exists())
+
+    def test_bulk_created_rows_refresh_their_roots(self):
+        self.snapshot.rebuild()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            DjangoRepository(Comment).set_input([{'text': 'bulk', 'article_id': self.article.pk}]).create_many()
+
+        self.assertEqual(len(self.get_data(self.person)['articles'][0]['comments']), 2)
+
+    def test_refresh_updates_snapshot_in_place(self):
+        self.snapshot.rebuild()
+        stored = IncludeSnapshot.objects.get(snapshot=self.snapshot.name, key=str(self.person.pk))
+
+        Comment.objects.filter(pk=self.comment.pk).update(text='changed')
+        self.snapshot.refresh_many([self.person.pk, self.person.pk])
+
+        refreshed = IncludeSnapshot.objects.get(snapshot=self.snapshot.name, key=str(self.person.pk))
+        self.assertEqual(refreshed.pk, stored.pk)
+        self.assertIn('changed', refreshed.data)
+
+    def test_save_updates_stored_and_inserts_new_snapshots(self):
+        self.snapshot.rebuild()
+        stored = IncludeSnapshot.objects.get(snapshot=self.snapshot.name, key=str(self.person.pk))
+        IncludeSnapshot.objects.filter(snapshot=self.snapshot.name, key=str(self.other_person.pk)).delete()
+
+        Comment.objects.filter(pk=self.comment.pk).update(text='changed')
+        self.snapshot.save(self.snapshot.build([self.person.pk, self.other_person.pk]))
+
+        self.assertEqual(IncludeSnapshot.objects.get(snapshot=self.snapshot.name, key=str(self.person.pk)).pk, stored.pk)
+        self.assertIn('changed', IncludeSnapshot.objects.get(pk=stored.pk).data)
+        self.assertTrue(IncludeSnapshot.objects.filter(snapshot=self.snapshot.name, key=str(self.other_person.pk)).exists())
+
+    def test_refresh_and_rebuild_remove_missing_rows(self):
+        IncludeSnapshot.objects.create(snapshot=self.snapshot.name, key='999', data='{}')
+        IncludeSnapshot.objects.create(snapshot=self.snapshot.name, key='998', data='{}')
+
+        self.snapshot.refresh_many([999])
+        self.assertFalse(IncludeSnapshot.objects.filter(snapshot=self.snapshot.name, key='999').exists())
+
+        self.snapshot.rebuild()
+        self.assertEqual(
+            sorted(IncludeSnapshot.objects.filter(snapshot=self.snapshot.name).values_list('key', flat=True)),
+            sorted([str(self.person.pk), str(self.other_person.pk)])
+        )
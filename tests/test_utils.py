@@ -1,5 +1,9 @@
+import datetime
+import json
+from decimal import Decimal
+
 from django.http.request import QueryDict
-from magicbox.utils import parse_qsl_with_brackets
+from magicbox.utils import parse_qsl_with_brackets, json_dumps
 from tests import MagicBoxTestCase as TestCase
 
 
@@ -37,6 +41,15 @@ class TestParsesQueryStringListWithBrackets(TestCase):
             }
         })
 
+    def test_can_parse_query_string_without_brackets(self):
+        qs = 'include=articles.comments&filters[name]==kirill'
+        query_list = QueryDict(qs, encoding='utf-8').lists()
+        parsed_qsl = parse_qsl_with_brackets(query_list)
+        self.assertEqual(parsed_qsl, {
+            'include': 'articles.comments',
+            'filters': {'name': '=kirill'},
+        })
+
     def test_can_correctly_parse_when_values_have_brackets(self):
         qs = 'filters[name]=[kirill,simon,joe,moe]'
         query_list = QueryDict(qs, encoding='utf-8').lists()
@@ -46,3 +59,14 @@ class TestParsesQueryStringListWithBrackets(TestCase):
                 'name': '[kirill,simon,joe,moe]',
             }
         })
+
+
+class TestJsonDumps(TestCase):
+    def test_can_dump_to_bytes(self):
+        dumped = json_dumps([{'name': 'kirill', 'articles': [{'id': 1}]}])
+        self.assertIsInstance(dumped, bytes)
+        self.assertEqual(json.loads(dumped.decode('utf-8')), [{'name': 'kirill', 'articles': [{'id': 1}]}])
+
+    def test_can_dump_database_values(self):
+        dumped = json_dumps({'price': Decimal('1.50'), 'created': datetime.date(2016, 8, 1)})
+        self.assertEqual(json.loads(dumped.decode('utf-8')), {'price': '1.50', 'created': '2016-08-01'})